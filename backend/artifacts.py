@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import asyncio
+import threading
+
+import db
+import metrics
+from batching import BATCH_SIZE, drop_near_duplicates
+from singleflight import SingleFlight
+
+# -----------------------------
+# Per-document artifact store
+# -----------------------------
+# Every flashcard and quiz question generated for a document is kept here,
+# keyed by the SHA-256 of the PDF, in the order it was generated. Paging
+# requests ("10 more questions") are served from the stored items the
+# client has not seen yet; only the shortfall is generated, with the
+# stored questions listed as ones to avoid, and near-duplicates of stored
+# items are never added. The store grows with every request, so most pages
+# end up served without an LLM call.
+ARTIFACTS_DB_PATH = os.getenv("ARTIFACTS_DB_PATH", os.path.join("cache", "artifacts.sqlite3"))
+# Most recent questions listed in a "do not repeat" prompt; older ones are
+# still filtered out by the near-duplicate check
+ARTIFACTS_EXCLUDE_MAX = int(os.getenv("ARTIFACTS_EXCLUDE_MAX", "50"))
+# Top-up generations per page before serving a short page
+ARTIFACTS_FILL_ROUNDS = 2
+
+_conn = None
+_lock = threading.Lock()
+_flights = SingleFlight("artifacts")
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = db.connect(ARTIFACTS_DB_PATH, """
+            CREATE TABLE IF NOT EXISTS items (
+                doc TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                item TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (doc, kind, seq)
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS items_key ON items (doc, kind, key);
+        """)
+    return _conn
+
+
+def _normalize(key):
+    return " ".join(str(key).lower().split())
+
+
+def count(doc, kind):
+    with _lock:
+        row = _connect().execute(
+            "SELECT COUNT(*) FROM items WHERE doc = ? AND kind = ?", (doc, kind)
+        ).fetchone()
+    return row[0]
+
+
+def items(doc, kind, offset=0, limit=None):
+    """Stored items in generation order, from `offset`, at most `limit` of them."""
+    with _lock:
+        rows = _connect().execute(
+            "SELECT item FROM items WHERE doc = ? AND kind = ? ORDER BY seq LIMIT ? OFFSET ?",
+            (doc, kind, -1 if limit is None else limit, offset),
+        ).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+
+def add(doc, kind, new_items, key):
+    """
+    Appends the items that are not (near-)duplicates of stored ones and
+    returns how many were added.
+    """
+    if not new_items:
+        return 0
+    with _lock:
+        conn = _connect()
+        rows = conn.execute(
+            "SELECT item FROM items WHERE doc = ? AND kind = ? ORDER BY seq", (doc, kind)
+        ).fetchall()
+        stored = [json.loads(row[0]) for row in rows]
+        fresh = drop_near_duplicates(stored + list(new_items), key)[len(stored):]
+
+        now = time.time()
+        seq = len(stored)
+        added = 0
+        for item in fresh:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO items (doc, kind, seq, key, item, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (doc, kind, seq, _normalize(key(item)), json.dumps(item, ensure_ascii=False), now),
+            )
+            if cursor.rowcount:
+                seq += 1
+                added += 1
+        conn.commit()
+    return added
+
+
+async def record(doc, kind, new_items, key):
+    """Stores items generated by the regular endpoints; never fails the request."""
+    if not doc or not isinstance(new_items, list):
+        return
+    try:
+        await asyncio.to_thread(add, doc, kind, new_items, key)
+    except Exception as e:
+        print(f"[ARTIFACTS] Could not store {kind}: {e}")
+
+
+async def page(doc, kind, offset, limit, generate, key):
+    """
+    Returns (items, total): up to `limit` stored items starting at `offset`,
+    generating the shortfall first if fewer are stored. generate(count,
+    exclude, start) must return new items unlike the `exclude` keys; `start`
+    is the number of batches already generated, for walking the document.
+    A page comes back short only if the document yields nothing new.
+    Callers keep `offset` at or below count(), so a request never generates
+    more than `limit` items; the shortfall is capped at `limit` regardless.
+    """
+    target = offset + limit
+    for _ in range(ARTIFACTS_FILL_ROUNDS):
+        have = await asyncio.to_thread(count, doc, kind)
+        metrics.cache_lookup("artifacts", have >= target)
+        if have >= target:
+            break
+        missing = min(target - have, limit)
+        # Concurrent pagers of one document share a generation
+        added = await _flights.do(
+            (doc, kind), lambda: _fill(doc, kind, missing, generate, key)
+        )
+        if not added:
+            break
+
+    served = await asyncio.to_thread(items, doc, kind, offset, limit)
+    total = await asyncio.to_thread(count, doc, kind)
+    return served, total
+
+
+async def _fill(doc, kind, missing, generate, key):
+    stored = await asyncio.to_thread(items, doc, kind)
+    exclude = [key(item) for item in stored[-ARTIFACTS_EXCLUDE_MAX:]]
+    new_items = await generate(missing, exclude, len(stored) // BATCH_SIZE)
+    added = await asyncio.to_thread(add, doc, kind, new_items or [], key)
+    print(f"[ARTIFACTS] {kind}: asked for {missing}, stored {added} new ({len(stored) + added} total)")
+    return added
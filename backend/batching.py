@@ -0,0 +1,127 @@
+import os
+import re
+import math
+import asyncio
+
+from pdf_utils import chunk_pages, join_pages
+
+# -----------------------------
+# Batched flashcard / quiz generation
+# -----------------------------
+# Large requests are split into batches of GENERATION_BATCH_SIZE items, each
+# drawn from a different slice of the document and generated concurrently.
+# A batch that fails or returns bad JSON only loses its own items.
+BATCH_SIZE = int(os.getenv("GENERATION_BATCH_SIZE", "10"))
+BATCH_CONCURRENCY = int(os.getenv("GENERATION_BATCH_CONCURRENCY", "4"))
+# Each batch asks for a few extra items to make up for near-duplicates
+BATCH_OVERSAMPLE = float(os.getenv("GENERATION_BATCH_OVERSAMPLE", "1.2"))
+# Slices smaller than this don't carry enough material for a batch
+MIN_BATCH_CHARS = int(os.getenv("GENERATION_MIN_BATCH_CHARS", "2000"))
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.7"))
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text, k=3):
+    """Set of k-word shingles of the normalized text (whole text if shorter)."""
+    words = _WORD.findall(text.lower())
+    if len(words) < k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def drop_near_duplicates(items, key, threshold=DUPLICATE_THRESHOLD):
+    """
+    Keeps the first of any group of items whose key(item) text has a shingle
+    Jaccard similarity of at least `threshold`. Order is preserved.
+    """
+    kept, kept_shingles = [], []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            text = key(item)
+        except (KeyError, TypeError):
+            continue
+        if not text:
+            continue
+        s = shingles(str(text))
+        if any(jaccard(s, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(item)
+        kept_shingles.append(s)
+    return kept
+
+
+def plan_batches(pages, n_items, max_chars, batch_size=BATCH_SIZE, start=0):
+    """
+    Splits n_items across document slices: returns [(text, count), ...] with
+    one distinct slice per batch, spread evenly over the document. `start`
+    shifts the slices along by that many, so successive calls for more
+    items (see artifacts.py) walk through the document.
+    """
+    n_batches = max(1, math.ceil(n_items / batch_size))
+    total = len(join_pages(pages))
+    slice_chars = min(max_chars, max(MIN_BATCH_CHARS, total // n_batches + 1))
+
+    chunks = chunk_pages(pages, slice_chars)
+    if not chunks:
+        return []
+
+    if len(chunks) > n_batches:
+        # More material than batches: sample slices evenly across the document
+        step = len(chunks) / n_batches
+        chunks = [chunks[(start + int(i * step)) % len(chunks)] for i in range(n_batches)]
+
+    n_batches = len(chunks)
+    base, extra = divmod(n_items, n_batches)
+    return [(chunk, base + (1 if i < extra else 0))
+            for i, chunk in enumerate(chunks)
+            if base + (1 if i < extra else 0) > 0]
+
+
+async def generate_in_batches(generate, batches, n_items, key):
+    """
+    Runs generate(text, count) for every planned batch with at most
+    BATCH_CONCURRENCY in flight, then merges, de-duplicates on key(item)
+    and trims to n_items.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(i, text, count):
+        async with semaphore:
+            try:
+                items = await generate(text, math.ceil(count * BATCH_OVERSAMPLE))
+            except Exception as e:
+                print(f"[BATCH {i}] failed: {e}")
+                return []
+        if not isinstance(items, list):
+            print(f"[BATCH {i}] returned {type(items).__name__}, dropping")
+            return []
+        return items
+
+    print(f"[BATCH] {n_items} items over {len(batches)} batches")
+    results = await asyncio.gather(
+        *(run(i, text, count) for i, (text, count) in enumerate(batches))
+    )
+
+    # Interleave batches so trimming drops items evenly across the document
+    merged = []
+    for round_items in _round_robin(results):
+        merged.extend(round_items)
+
+    unique = drop_near_duplicates(merged, key)
+    print(f"[BATCH] {len(merged)} generated, {len(unique)} unique, returning {min(len(unique), n_items)}")
+    return unique[:n_items]
+
+
+def _round_robin(lists):
+    longest = max((len(items) for items in lists), default=0)
+    for i in range(longest):
+        yield [items[i] for items in lists if i < len(items)]
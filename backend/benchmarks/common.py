@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import math
+import tempfile
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import quote
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOADS_DIR = os.path.join(BACKEND_DIR, "uploads")
+
+
+def isolate_caches():
+    """
+    Points every on-disk cache at a fresh temporary directory so runs are
+    reproducible and never touch the real caches. Call before importing
+    any backend module.
+    """
+    root = tempfile.mkdtemp(prefix="bench-")
+    os.environ["PDF_CACHE_DIR"] = os.path.join(root, "pdf")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(root, "llm.sqlite3")
+    os.environ["JOBS_DB_PATH"] = os.path.join(root, "jobs.sqlite3")
+    os.environ["ARTIFACTS_DB_PATH"] = os.path.join(root, "artifacts.sqlite3")
+    os.environ["RETRIEVAL_INDEX_DIR"] = os.path.join(root, "index")
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    return root
+
+
+def upload_files():
+    return sorted(
+        os.path.join(UPLOADS_DIR, name)
+        for name in os.listdir(UPLOADS_DIR)
+        if name.lower().endswith(".pdf")
+    )
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory):
+    """
+    Serves `directory` over HTTP on a free localhost port from a daemon
+    thread (stands in for Cloudinary). Returns (server, base_url).
+    """
+    handler = partial(_QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def file_url(base_url, path):
+    return f"{base_url}/{quote(os.path.basename(path))}"
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list (q in 0..100)."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_latencies(latencies):
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its reaped children, or None."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # bytes vs KiB
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / divisor, 1)
+
+
+def print_table(rows, columns):
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def check_regressions(results, baseline_path, metric, max_regression):
+    """
+    Compares results[name][metric] with a previous run's JSON output.
+    Returns the list of (name, before, after) that got more than
+    max_regression (a fraction) worse.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    for name, row in results.items():
+        before = baseline.get(name, {}).get(metric)
+        after = row.get(metric)
+        if before and after is not None and after > before * (1 + max_regression):
+            regressions.append((name, before, after))
+    return regressions
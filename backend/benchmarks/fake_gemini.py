@@ -0,0 +1,116 @@
+import re
+import json
+import random
+import asyncio
+from types import SimpleNamespace
+
+# -----------------------------
+# Local Gemini stand-in
+# -----------------------------
+# Mimics the parts of google.generativeai's GenerativeModel the backend uses
+# (generate_content_async, with and without stream=True, JSON mode with a
+# response schema). Each call waits `latency` seconds to first token, then
+# emits output at `tokens_per_second`. No network, no API key.
+
+_WORDS = """
+    atom basis cell cycle data delta energy enzyme entropy field flux force
+    gene graph heat integral kernel lattice limit matrix mean model node
+    orbit phase plane prime proof quantum rate ratio signal space state
+    tensor theorem vector wave yield
+""".split()
+
+_COUNT = re.compile(r"(?:exactly|Generate)\s+(\d+)", re.IGNORECASE)
+
+
+class FakeRateLimitError(Exception):
+    """Raised for injected failures; installed as retryable."""
+
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens, output_tokens):
+        self.text = text
+        self.parts = [text] if text else []
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+
+
+class FakeStream:
+    def __init__(self, model, text):
+        self._model = model
+        self._words = text.split(" ")
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        await asyncio.sleep(self._model.latency)
+        step = 8
+        for i in range(0, len(self._words), step):
+            piece = " ".join(self._words[i:i + step]) + " "
+            await asyncio.sleep(len(piece) / 4 / self._model.tokens_per_second)
+            yield FakeResponse(piece, 0, len(piece) // 4)
+
+
+class FakeGeminiModel:
+    def __init__(self, latency=0.3, tokens_per_second=200.0, output_tokens=300,
+                 failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.prompt_tokens = 0
+
+    def _words(self, n):
+        return " ".join(self.random.choice(_WORDS) for _ in range(n))
+
+    def _value(self, schema, prompt, name=""):
+        kind = schema.get("type")
+        if kind == "array":
+            match = _COUNT.search(prompt)
+            count = int(match.group(1)) if match else 5
+            return [self._value(schema["items"], prompt) for _ in range(count)]
+        if kind == "object":
+            return {
+                key: self._value(sub, prompt, key)
+                for key, sub in schema.get("properties", {}).items()
+            }
+        if "enum" in schema:
+            return self.random.choice(schema["enum"])
+        # Distinct random words so near-duplicate filtering keeps the items
+        return f"{name} {self._words(12)}".strip()
+
+    def render(self, prompt, config):
+        if config.get("response_mime_type") == "application/json":
+            return json.dumps(self._value(config.get("response_schema", {}), prompt))
+        return self._words(self.output_tokens)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        prompt_tokens = len(prompt) // 4
+        self.prompt_tokens += prompt_tokens
+
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            await asyncio.sleep(self.latency / 4)
+            raise FakeRateLimitError("429 (injected)")
+
+        text = self.render(prompt, dict(generation_config or {}))
+        if stream:
+            return FakeStream(self, text)
+
+        output_tokens = len(text) // 4
+        await asyncio.sleep(self.latency + output_tokens / self.tokens_per_second)
+        return FakeResponse(text, prompt_tokens, output_tokens)
+
+
+def install(model):
+    """Makes llm.generate() use `model` instead of the real SDK."""
+    import llm
+
+    llm._model = model
+    llm._retryable = (FakeRateLimitError,)
+    return model
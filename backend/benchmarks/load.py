@@ -0,0 +1,169 @@
+"""
+Concurrent load test of /summarize, /flashcards, /quiz and /chatbot.
+
+    cd backend
+    python -m benchmarks.load [--requests 40] [--concurrency 8]
+        [--latency 0.3] [--tokens-per-second 200] [--failure-rate 0]
+        [--endpoints summarize,flashcards,quiz,chatbot] [--cached]
+        [--json out.json] [--baseline previous.json --max-regression 0.25]
+        [--verbose]
+
+Runs fully offline: the app is driven in-process over ASGI, the PDFs in
+backend/uploads are served from a local HTTP server, Gemini is replaced by
+benchmarks.fake_gemini and every cache lives in a temporary directory.
+Generation requests set regenerate=true unless --cached is given, so each
+one reaches the (fake) model. Concurrent identical requests are still
+coalesced, as in production.
+
+Reports p50/p95/p99 latency, throughput, errors and model calls per
+endpoint plus peak RSS. With --baseline, exits non-zero if any p95 got
+more than --max-regression worse.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import contextlib
+
+from benchmarks.common import (
+    isolate_caches, upload_files, serve_directory, file_url, summarize_latencies,
+    peak_rss_mb, print_table, write_json, check_regressions, UPLOADS_DIR,
+)
+
+ENDPOINTS = ("summarize", "flashcards", "quiz", "chatbot")
+
+_QUESTIONS = (
+    "What is the main idea of this course?",
+    "Explain the key definitions.",
+    "How are the examples solved?",
+    "Summarize the important results.",
+)
+
+
+def build_payload(endpoint, i, urls, cached):
+    url = urls[i % len(urls)]
+    regenerate = not cached
+    if endpoint == "summarize":
+        return {"fileURL": url, "user_prompt": _QUESTIONS[i % len(_QUESTIONS)],
+                "full_document": False, "regenerate": regenerate}
+    if endpoint == "flashcards":
+        return {"fileURL": url, "n_cards": 5 + i % 5, "regenerate": regenerate}
+    if endpoint == "quiz":
+        return {"fileURL": url, "n_questions": 5 + i % 5, "regenerate": regenerate}
+    return {"user_prompt": _QUESTIONS[i % len(_QUESTIONS)], "fileURLs": urls}
+
+
+async def drive(client, endpoint, n_requests, concurrency, urls, cached):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(f"/{endpoint}", json=build_payload(endpoint, i, urls, cached))
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+async def run(args):
+    isolate_caches()
+    # The benchmark measures the backend, not the production rate limits
+    os.environ.setdefault("GEMINI_RPM", "1000000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000")
+    os.environ.setdefault("GEMINI_BACKOFF_BASE", "0.05")
+
+    import httpx
+    from benchmarks import fake_gemini
+
+    import_started = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - import_started
+
+    model = fake_gemini.install(fake_gemini.FakeGeminiModel(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        failure_rate=args.failure_rate,
+    ))
+
+    server, base_url = serve_directory(UPLOADS_DIR)
+    urls = [file_url(base_url, path) for path in upload_files()]
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Warm the PDF cache so every endpoint sees the same starting point
+        for url in urls:
+            await main.extract_pages_from_pdf_url_async(url)
+
+        for endpoint in args.endpoints:
+            calls_before = model.calls
+            latencies, errors, elapsed = await drive(
+                client, endpoint, args.requests, args.concurrency, urls, args.cached
+            )
+            results[endpoint] = {
+                "endpoint": endpoint,
+                "requests": len(latencies),
+                "errors": errors,
+                **summarize_latencies(latencies),
+                "req_per_s": round(len(latencies) / elapsed, 2),
+                "model_calls": model.calls - calls_before,
+            }
+
+    server.shutdown()
+    return results, import_seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake model time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls that get a 429")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--cached", action="store_true", help="let the LLM response cache answer")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--verbose", action="store_true", help="show the backend's own log lines")
+    args = parser.parse_args(argv)
+    args.endpoints = [e for e in args.endpoints.split(",") if e]
+
+    with open(os.devnull, "w") as devnull:
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with quiet:
+            results, import_seconds = asyncio.run(run(args))
+
+    print_table(
+        list(results.values()),
+        ["endpoint", "requests", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms", "req_per_s", "model_calls"],
+    )
+    rss = peak_rss_mb()
+    print(f"import main: {import_seconds:.2f}s  peak RSS: {rss} MB")
+
+    if args.json:
+        write_json(args.json, {
+            "results": results,
+            "import_seconds": round(import_seconds, 3),
+            "peak_rss_mb": rss,
+            "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        })
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, "p95_ms", args.max_regression)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p95 {before} -> {after} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Micro-benchmarks for PDF extraction and context selection on backend/uploads.
+
+    cd backend
+    python -m benchmarks.pdf_bench [--repeat 5] [--json out.json]
+        [--baseline previous.json --max-regression 0.25]
+
+Reports the median and best wall time per operation and file. With
+--baseline, exits non-zero if any median got more than --max-regression
+slower.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+from benchmarks.common import (
+    isolate_caches, upload_files, peak_rss_mb, print_table, write_json, check_regressions,
+)
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run(repeat):
+    isolate_caches()
+    import pdf_utils
+    import context
+
+    results = {}
+    for path in upload_files():
+        name = os.path.basename(path)
+        n_pages = pdf_utils.count_pages(path)
+        pages = pdf_utils.extract_pages(path)
+        source = pdf_utils.extract_pages(path, max_chars=context.CONTEXT_SOURCE_CHARS)
+
+        operations = {
+            "count_pages": lambda: pdf_utils.count_pages(path),
+            "extract/pdfplumber": lambda: pdf_utils.extract_pages(path),
+            "extract/pdfminer": lambda: pdf_utils.extract_pages(path, backend="pdfminer"),
+            "extract/budget": lambda: pdf_utils.extract_pages(
+                path, max_chars=context.CONTEXT_SOURCE_CHARS
+            ),
+            "extract/parallel": lambda: pdf_utils.extract_text_from_pdf(path, parallel=True),
+            "chunk_pages": lambda: pdf_utils.chunk_pages(pages, 12000),
+            "select_context": lambda: context.select_context(source, 3000),
+        }
+        # One untimed run so the process pool and imports are not measured
+        pdf_utils.extract_text_from_pdf(path, parallel=True)
+
+        for operation, fn in operations.items():
+            timings = _time(fn, repeat)
+            results[f"{name} {operation}"] = {
+                "file": name,
+                "pages": n_pages,
+                "operation": operation,
+                "median_ms": round(statistics.median(timings) * 1000, 1),
+                "best_ms": round(min(timings) * 1000, 1),
+            }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    print_table(list(results.values()), ["file", "pages", "operation", "median_ms", "best_ms"])
+    print(f"peak RSS: {peak_rss_mb()} MB")
+
+    if args.json:
+        write_json(args.json, {"results": results, "peak_rss_mb": peak_rss_mb()})
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, "median_ms", args.max_regression)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before} -> {after} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
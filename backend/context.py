@@ -0,0 +1,187 @@
+import os
+import re
+from collections import Counter
+
+import metrics
+from pdf_utils import chunk_pages, join_pages
+
+# -----------------------------
+# Prompt context selection
+# -----------------------------
+# Instead of cutting the document at a fixed character count, prompts are
+# packed to a token budget:
+#   1. running headers/footers (lines repeated at the top or bottom of most
+#      pages) and bare page numbers are dropped;
+#   2. the text is split into sections of about CONTEXT_SECTION_CHARS;
+#   3. sections are scored by TF-IDF salience (similarity to the document
+#      centroid, plus the user's prompt when given) and picked greedily with
+#      a redundancy penalty so the budget covers distinct parts of the text;
+#   4. the picked sections are emitted in document order.
+# A text that already fits the budget is only cleaned, never reordered.
+
+# Characters extracted from a PDF for selection to choose from
+CONTEXT_SOURCE_CHARS = int(os.getenv("CONTEXT_SOURCE_CHARS", "40000"))
+CONTEXT_SECTION_CHARS = int(os.getenv("CONTEXT_SECTION_CHARS", "1200"))
+# Weight of similarity to already picked sections (0 = pure salience)
+CONTEXT_DIVERSITY = float(os.getenv("CONTEXT_DIVERSITY", "0.7"))
+CONTEXT_QUERY_WEIGHT = float(os.getenv("CONTEXT_QUERY_WEIGHT", "0.5"))
+# Characters per count_tokens() token in dense (formula-heavy) lecture
+# notes; prose runs closer to 4.5. Sizes character slices to fit a token budget.
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "2.5"))
+
+# A line is a header/footer if it opens or closes at least this share of pages
+BOILERPLATE_MIN_SHARE = 0.5
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_EDGE_LINES = 3
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_TERM = re.compile(r"[a-z][a-z0-9]{2,}")
+_DIGITS = re.compile(r"\d+")
+_PAGE_NUMBER = re.compile(
+    r"^\s*(page\s*)?[-–—(\[]?\s*\d{1,4}\s*[-–—)\]]?\s*((of|/)\s*\d{1,4})?\s*$", re.IGNORECASE
+)
+
+_STOPWORDS = frozenset("""
+    the and for are but not you all any can had her was one our out has have
+    his how its may new now see two who did get him let say she too use this
+    that with from they will would there their what about which when make
+    like than then them these some could into more other such only also been
+    were each where most over very your just those through between because
+    while being both after before under same here used using
+""".split())
+
+
+def count_tokens(text):
+    """
+    Local estimate of Gemini tokens: one per word or punctuation mark, plus
+    one per 8 characters of long words (which split into several pieces).
+    The one estimator behind every token budget: prompt context, the
+    rate limiter's TPM reservations and chat session memory.
+    """
+    if not text:
+        return 0
+    pieces = _TOKEN.findall(text)
+    return len(pieces) + sum(len(piece) // 8 for piece in pieces if len(piece) > 8)
+
+
+def chars_for_tokens(max_tokens):
+    """Slice length in characters that stays within max_tokens for most text."""
+    return int(max_tokens * CONTEXT_CHARS_PER_TOKEN)
+
+
+def _signature(line):
+    # "Lecture 3 - Page 12" and "Lecture 3 - Page 13" are the same footer
+    return _DIGITS.sub("#", line.strip().lower())
+
+
+def strip_boilerplate(pages):
+    """Drops repeated headers/footers and page-number lines from every page."""
+    page_lines = [[line for line in (page or "").split("\n") if line.strip()] for page in pages]
+
+    def edges(lines):
+        n = BOILERPLATE_EDGE_LINES
+        return range(len(lines)) if len(lines) <= 2 * n else [*range(n), *range(len(lines) - n, len(lines))]
+
+    repeated = set()
+    if len(pages) >= BOILERPLATE_MIN_PAGES:
+        counts = Counter()
+        for lines in page_lines:
+            counts.update({_signature(lines[i]) for i in edges(lines)})
+        threshold = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_SHARE * len(pages))
+        repeated = {sig for sig, count in counts.items() if count >= threshold}
+
+    cleaned = []
+    for lines in page_lines:
+        edge = set(edges(lines))
+        kept = [
+            line for i, line in enumerate(lines)
+            if not (i in edge and (_PAGE_NUMBER.match(line) or _signature(line) in repeated))
+        ]
+        cleaned.append("\n".join(kept))
+    return cleaned
+
+
+def _tfidf(sections, query=None):
+    """Row-normalized TF-IDF matrix of the sections, and the query vector."""
+    import numpy as np  # only needed once a text is over budget
+
+    vocab, rows, cols = {}, [], []
+    for i, section in enumerate(sections):
+        for term in _TERM.findall(section.lower()):
+            if term not in _STOPWORDS:
+                rows.append(i)
+                cols.append(vocab.setdefault(term, len(vocab)))
+
+    tf = np.zeros((len(sections), max(1, len(vocab))), dtype=np.float32)
+    np.add.at(tf, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+    tf = np.log1p(tf)  # sublinear: a term repeated 20 times is not 20x as salient
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(sections)) / (1 + df)) + 1.0
+    matrix = tf * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+    query_vector = None
+    if query:
+        terms = [vocab[t] for t in _TERM.findall(query.lower()) if t in vocab]
+        if terms:
+            query_vector = np.zeros(matrix.shape[1], dtype=np.float32)
+            np.add.at(query_vector, np.array(terms, dtype=np.intp), 1.0)
+            query_vector *= idf
+            query_vector /= np.linalg.norm(query_vector)
+    return matrix, query_vector
+
+
+def rank_sections(sections, query=None):
+    """Salience score per section (higher is more central to the document)."""
+    import numpy as np
+
+    matrix, query_vector = _tfidf(sections, query)
+    centroid = matrix.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    scores = matrix @ (centroid / norm) if norm > 0 else np.zeros(len(sections), dtype=np.float32)
+    if query_vector is not None:
+        scores = scores + CONTEXT_QUERY_WEIGHT * (matrix @ query_vector)
+    return scores, matrix
+
+
+@metrics.stage("select_context")
+def select_context(pages, max_tokens, query=None):
+    """
+    Returns the text to put in a prompt: the cleaned document if it fits in
+    max_tokens, otherwise the most salient, least redundant sections that do,
+    in document order. `pages` is a list of page texts or a single string.
+    """
+    if isinstance(pages, str):
+        pages = [pages]
+    pages = strip_boilerplate(pages)
+
+    text = join_pages(pages)
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    import numpy as np
+
+    sections = chunk_pages(pages, CONTEXT_SECTION_CHARS)
+    costs = np.array([count_tokens(s) + 1 for s in sections])
+    scores, matrix = rank_sections(sections, query)
+    similarity = matrix @ matrix.T
+
+    available = costs <= max_tokens
+    redundancy = np.zeros(len(sections), dtype=np.float32)
+    picked, budget = [], max_tokens
+    while available.any():
+        gain = np.where(available, scores - CONTEXT_DIVERSITY * redundancy, -np.inf)
+        best = int(np.argmax(gain))
+        available[best] = False
+        if costs[best] > budget:
+            continue
+        picked.append(best)
+        budget -= costs[best]
+        redundancy = np.maximum(redundancy, similarity[best])
+        available &= costs <= budget
+
+    print(f"[CONTEXT] Kept {len(picked)}/{len(sections)} sections, "
+          f"{max_tokens - budget}/{count_tokens(text)} tokens")
+    return "\n".join(sections[i] for i in sorted(picked))
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+
+# -----------------------------
+# SQLite connections
+# -----------------------------
+# The LLM cache, artifact store, job queue and token store are SQLite files
+# shared by every worker on the host. Each opens one connection per process
+# through connect(): WAL so readers never block the writer, and a busy
+# timeout so a write that meets another process's lock waits instead of
+# failing at once.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def connect(path, schema, **options):
+    """
+    Opens `path` (creating its directory) and applies `schema`, a script of
+    CREATE ... IF NOT EXISTS statements. `options` go to sqlite3.connect.
+    Callers serialise access with their own lock.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, **options)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.executescript(schema)
+    conn.commit()
+    return conn
@@ -1,24 +1,87 @@
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-import json
-import re
+import llm
+import llm_cache
+import context
+import batching
+import structured
 
-load_dotenv()
+MODEL_NAME = llm.MODEL_NAME
+# Bump whenever the prompt changes so cached flashcards are regenerated
+PROMPT_VERSION = "flashcards-v2"
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("gemini-flash-latest")
+# Tokens of notes sent to the model per call (see context.select_context)
+FLASHCARDS_CONTEXT_TOKENS = int(os.getenv("FLASHCARDS_CONTEXT_TOKENS", "3000"))
+# Characters of the document slice each batch of a large deck draws from,
+# sized so a slice fits the per-call token budget
+FLASHCARDS_MAX_CHARS = context.chars_for_tokens(FLASHCARDS_CONTEXT_TOKENS)
 
-def safe_json_loads(raw: str):
+FLASHCARD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "answer": {"type": "string"},
+    },
+    "required": ["question", "answer"],
+}
+
+
+async def generate_flashcards(notes: str, n_cards: int = 10, regenerate: bool = False,
+                              priority: int = llm.PRIORITY_NORMAL):
+    """`notes` is used as given; callers size it to FLASHCARDS_CONTEXT_TOKENS."""
+    key = llm_cache.cache_key(MODEL_NAME, PROMPT_VERSION, notes=notes, n_cards=n_cards)
+    return await llm_cache.cached(
+        key, lambda: _generate_flashcards(notes, n_cards, priority=priority), bypass=regenerate
+    )
+
+
+async def generate_flashcards_batched(pages, n_cards: int, regenerate: bool = False):
     """
-    Fix invalid JSON escapes caused by LaTeX (\pi, \cos, \frac, etc.)
+    Large decks: n_cards is spread over batches drawn from different parts of
+    the document, generated concurrently (at bulk priority) and
+    de-duplicated by question.
     """
-    fixed = re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', raw)
-    return json.loads(fixed)
+    pages = context.strip_boilerplate(pages)
+    batches = batching.plan_batches(pages, n_cards, FLASHCARDS_MAX_CHARS)
+    return await batching.generate_in_batches(
+        lambda text, n: generate_flashcards(
+            text, n, regenerate=regenerate, priority=llm.PRIORITY_BULK
+        ),
+        batches,
+        n_cards,
+        key=lambda card: f"{card['question']} {card['answer']}",
+    )
 
 
-def generate_flashcards(notes: str, n_cards: int = 10):
-    prompt = f"""
+async def generate_more_flashcards(pages, n_cards: int, exclude=(), start: int = 0):
+    """
+    Paging (see artifacts.py): n_cards cards whose questions differ from
+    `exclude`, drawn from the document slices `start` batches along.
+    Not cached here; the artifact store keeps the results.
+    """
+    pages = context.strip_boilerplate(pages)
+    batches = batching.plan_batches(pages, n_cards, FLASHCARDS_MAX_CHARS, start=start)
+    return await batching.generate_in_batches(
+        lambda text, n: _generate_flashcards(text, n, exclude, llm.PRIORITY_BULK),
+        batches,
+        n_cards,
+        key=lambda card: f"{card['question']} {card['answer']}",
+    )
+
+
+def card_key(card):
+    return card["question"]
+
+
+def build_flashcards_prompt(notes: str, n_cards: int, exclude=()):
+    avoid = ""
+    if exclude:
+        listed = "\n".join(f"    - {q}" for q in exclude)
+        avoid = f"""
+    Do NOT repeat or rephrase any of these existing questions:
+{listed}
+"""
+
+    return f"""
     You are an academic assistant.
 
     Generate exactly {n_cards} flashcards from the notes.
@@ -26,31 +89,28 @@ def generate_flashcards(notes: str, n_cards: int = 10):
     Rules:
     - Questions and answers must be plain text
     - DO NOT use LaTeX or symbols
-    - Output ONLY valid JSON (no markdown)
-
-    Format:
-    [
-      {{
-        "question": "...",
-        "answer": "..."
-      }}
-    ]
-
+    - Each flashcard is an object with a "question" and an "answer"
+{avoid}
     Notes:
     {notes}
     """
 
-    response = model.generate_content(prompt)
-    raw = response.text.strip()
 
-    raw = re.sub(r"^```json\s*", "", raw)
-    raw = re.sub(r"\s*```$", "", raw)
+def _valid_card(card):
+    return (
+        isinstance(card, dict)
+        and isinstance(card.get("question"), str) and card["question"].strip() != ""
+        and isinstance(card.get("answer"), str) and card["answer"].strip() != ""
+    )
 
-    raw = raw.replace("\\", "").replace("$", "")
 
-    try:
-        return json.loads(raw)
-    except Exception as e:
-        print("JSON parse failed:", e)
-        print("RAW OUTPUT:", raw)
-        return []
+async def _generate_flashcards(notes: str, n_cards: int, exclude=(), priority=llm.PRIORITY_NORMAL):
+    return await structured.generate_items(
+        lambda count, exclude: build_flashcards_prompt(notes, count, exclude),
+        FLASHCARD_SCHEMA,
+        n_cards,
+        validate=_valid_card,
+        key=card_key,
+        priority=priority,
+        exclude=exclude,
+    )
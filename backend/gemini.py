@@ -1,14 +1,20 @@
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import asyncio
+import hashlib
+import llm
+import llm_cache
+import context
+import metrics
+from pdf_utils import chunk_pages, extract_pages_from_pdf_url_async, join_pages, PDFNoTextError
 
-load_dotenv()
+MODEL_NAME = llm.MODEL_NAME
+# Bump whenever a summary prompt changes so cached summaries are regenerated
+PROMPT_VERSION = "summary-v1"
+# Tokens of content per summary prompt (see context.select_context)
+SUMMARY_CONTEXT_TOKENS = int(os.getenv("SUMMARY_CONTEXT_TOKENS", "3000"))
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("gemini-flash-latest")
-
-def summarize_text(text, user_prompt):
-    prompt = f"""
+def build_summary_prompt(text, user_prompt):
+    return f"""
     You are an academic assistant.
 
     Summarize the following academic content clearly and concisely.
@@ -19,11 +25,172 @@ def summarize_text(text, user_prompt):
     - Here is the user provided prompt: {user_prompt}
 
     Content:
-    {text[:12000]}
+    {text}
+    """
+
+def _summary_key(text, user_prompt):
+    return llm_cache.cache_key(MODEL_NAME, PROMPT_VERSION, text=text, user_prompt=user_prompt)
+
+async def summarize_text(text, user_prompt, regenerate=False, priority=llm.PRIORITY_NORMAL):
+    """
+    Summarizes `text` as given: callers size it to SUMMARY_CONTEXT_TOKENS
+    (context.select_context, or the map-reduce chunks below).
     """
+    key = _summary_key(text, user_prompt)
+    return await llm_cache.cached(key, lambda: _summarize_text(text, user_prompt, priority), bypass=regenerate)
+
+async def _summarize_text(text, user_prompt, priority):
+    with metrics.stage("prompt"):
+        prompt = build_summary_prompt(text, user_prompt)
 
     print("Calling Gemini...")
-    response = model.generate_content(prompt)
+    response = await llm.generate(prompt, priority)
     print("Gemini response received")
 
     return response.text
+
+async def stream_summary(text, user_prompt, regenerate=False):
+    """
+    Yields the summary text chunk by chunk as Gemini produces it.
+    Closing the generator early (client went away) abandons the stream.
+    A cached summary is yielded as a single chunk.
+    """
+    key = _summary_key(text, user_prompt)
+    if not regenerate:
+        hit = await asyncio.to_thread(llm_cache.get, key)
+        metrics.cache_lookup("llm", hit is not None)
+        if hit is not None:
+            yield hit
+            return
+
+    with metrics.stage("prompt"):
+        prompt = build_summary_prompt(text, user_prompt)
+
+    print("Calling Gemini (streaming)...")
+    response = await llm.generate(prompt, llm.PRIORITY_INTERACTIVE, stream=True)
+    parts = []
+    try:
+        async for chunk in response:
+            # chunks carrying only safety/finish metadata have no parts
+            if chunk.parts:
+                parts.append(chunk.text)
+                yield chunk.text
+    finally:
+        # also runs when the client went away mid-stream
+        await response.aclose()
+
+    # Only a stream that ran to the end is worth caching
+    if parts:
+        await asyncio.to_thread(llm_cache.put, key, "".join(parts))
+
+# -----------------------------
+# Map-reduce over the whole document
+# -----------------------------
+# Each chunk is one map call, so it is sized to the summary token budget
+SUMMARY_CHUNK_CHARS = int(
+    os.getenv("SUMMARY_CHUNK_CHARS", str(context.chars_for_tokens(SUMMARY_CONTEXT_TOKENS)))
+)
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_REDUCE_FAN_IN = int(os.getenv("SUMMARY_REDUCE_FAN_IN", "6"))
+
+def build_reduce_prompt(summaries, user_prompt):
+    joined = "\n\n".join(f"Part {i + 1}:\n{s}" for i, s in enumerate(summaries))
+    return f"""
+    You are an academic assistant.
+
+    The following are summaries of consecutive parts of one academic document.
+    Merge them into a single clear and concise summary of the whole document.
+    Keep the order of topics, remove repetition, and keep:
+    - Key concepts
+    - Important definitions
+    - Main results or conclusions
+    - Here is the user provided prompt: {user_prompt}
+
+    Partial summaries:
+    {joined}
+    """
+
+
+async def summarize_document(pages, user_prompt, regenerate=False, priority=llm.PRIORITY_NORMAL):
+    """
+    Summarizes every page: chunks are summarized concurrently (at most
+    SUMMARY_CONCURRENCY Gemini calls in flight), then partial summaries are
+    merged SUMMARY_REDUCE_FAN_IN at a time until one summary is left.
+    """
+    chunks = chunk_pages(context.strip_boilerplate(pages), SUMMARY_CHUNK_CHARS)
+    if not chunks:
+        return ""
+    if len(chunks) == 1:
+        return await summarize_text(chunks[0], user_prompt, regenerate=regenerate, priority=priority)
+
+    key = llm_cache.cache_key(
+        MODEL_NAME, PROMPT_VERSION,
+        chunks=[hashlib.sha256(c.encode("utf-8")).hexdigest() for c in chunks],
+        user_prompt=user_prompt,
+    )
+    return await llm_cache.cached(
+        key, lambda: _map_reduce(chunks, user_prompt, regenerate, priority), bypass=regenerate
+    )
+
+
+async def _map_reduce(chunks, user_prompt, regenerate, priority):
+
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    print(f"[SUMMARY] Map over {len(chunks)} chunks")
+    summaries = await asyncio.gather(
+        *(bounded(summarize_text(chunk, user_prompt, regenerate, priority)) for chunk in chunks)
+    )
+
+    async def reduce_group(group):
+        if len(group) == 1:
+            return group[0]
+        with metrics.stage("prompt"):
+            prompt = build_reduce_prompt(group, user_prompt)
+        response = await llm.generate(prompt, priority)
+        return response.text
+
+    while len(summaries) > 1:
+        groups = [summaries[i:i + SUMMARY_REDUCE_FAN_IN]
+                  for i in range(0, len(summaries), SUMMARY_REDUCE_FAN_IN)]
+        print(f"[SUMMARY] Reduce {len(summaries)} summaries in {len(groups)} groups")
+        summaries = await asyncio.gather(*(bounded(reduce_group(group)) for group in groups))
+
+    return summaries[0]
+
+
+# -----------------------------
+# Summary of a PDF
+# -----------------------------
+async def summarize_pdf_url(file_url, user_prompt, full_document=False, regenerate=False,
+                            priority=llm.PRIORITY_NORMAL):
+    """
+    Returns (summary, full_document). A PDF whose text fits in
+    CONTEXT_SOURCE_CHARS gets one call over its most salient sections
+    (context.select_context); a longer one, or any with full_document=True,
+    is summarized page by page with summarize_document, so nothing past the
+    extraction budget is dropped. full_document in the result says which
+    path ran. Raises PDFNoTextError for a PDF without text.
+    """
+    if not full_document:
+        pages = await extract_pages_from_pdf_url_async(file_url, max_chars=context.CONTEXT_SOURCE_CHARS)
+        # extraction stops at the budget, so reaching it means pages were left out
+        if len(join_pages(pages)) < context.CONTEXT_SOURCE_CHARS:
+            text = await asyncio.to_thread(
+                context.select_context, pages, SUMMARY_CONTEXT_TOKENS, user_prompt
+            )
+            if not text.strip():
+                raise PDFNoTextError("No text found in PDF")
+            summary = await summarize_text(text, user_prompt, regenerate=regenerate, priority=priority)
+            return summary, False
+        print(f"[SUMMARY] Over {context.CONTEXT_SOURCE_CHARS} chars, summarizing every page")
+
+    pages = await extract_pages_from_pdf_url_async(file_url)
+    if not join_pages(pages).strip():
+        raise PDFNoTextError("No text found in PDF")
+    summary = await summarize_document(pages, user_prompt, regenerate=regenerate, priority=priority)
+    return summary, True
@@ -1,10 +1,19 @@
 from fastapi import APIRouter, HTTPException, Query
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 import os
-import requests
+import time
+import asyncio
+import datetime
+import threading
 from dotenv import load_dotenv
 
+from singleflight import SingleFlight
+import metrics
+import prefetch
+import http_client
+import token_store
+
 load_dotenv()
 
 router = APIRouter(prefix="/google", tags=["Google Classroom"])
@@ -22,8 +31,330 @@ CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")
 
-# Temporary storage for tokens (in-memory)
-user_tokens = {}
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+# Signed-in users' tokens are in token_store (shared by every worker).
+# Access tokens are refreshed this long before they expire: in the
+# background while still valid, before the request once they are not.
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "600"))
+
+# -----------------------------
+# Classroom client and listing cache
+# -----------------------------
+# One Classroom service per signed-in user, built from the discovery document
+# bundled with google-api-python-client (no discovery round trip). The
+# service is shared by worker threads, each with its own httplib2 connection,
+# since httplib2 is not thread-safe. The Google client libraries are
+# imported when the first client is built, not at server start.
+#
+# Listings are cached per user. Within the TTL they are served as-is; after
+# it (up to CLASSROOM_STALE_SECONDS more) the cached copy is returned
+# immediately and revalidated in the background. Classroom has no ETags, so
+# revalidation lists only (id, updateTime) and refetches the full listing
+# only when that fingerprint changed.
+CLASSROOM_WORKERS = int(os.getenv("CLASSROOM_WORKERS", "8"))
+CLASSROOM_PAGE_SIZE = int(os.getenv("CLASSROOM_PAGE_SIZE", "100"))
+CLASSROOM_COURSES_TTL = int(os.getenv("CLASSROOM_COURSES_TTL", "300"))
+CLASSROOM_MATERIALS_TTL = int(os.getenv("CLASSROOM_MATERIALS_TTL", "120"))
+CLASSROOM_STALE_SECONDS = int(os.getenv("CLASSROOM_STALE_SECONDS", "3600"))
+CLASSROOM_CACHE_MAX = int(os.getenv("CLASSROOM_CACHE_MAX", "5000"))
+CLASSROOM_MAX_CLIENTS = int(os.getenv("CLASSROOM_MAX_CLIENTS", "1000"))
+
+_executor = ThreadPoolExecutor(max_workers=CLASSROOM_WORKERS, thread_name_prefix="classroom")
+_clients = OrderedDict()
+_listings = OrderedDict()
+_flights = SingleFlight("classroom")
+_background = set()
+
+
+def _in_background(coro):
+    """Runs coro as a task that outlives the request (a reference keeps it alive)."""
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def _utcnow():
+    # google-auth works with naive UTC datetimes
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _expiry_from(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _token_record(credentials):
+    """What token_store keeps per user; the client id and secret come from the environment."""
+    expiry = credentials.expiry
+    return {
+        'token': credentials.token,
+        'refresh_token': credentials.refresh_token,
+        'scopes': list(credentials.scopes or []),
+        'expiry': expiry.replace(tzinfo=datetime.timezone.utc).timestamp() if expiry else None,
+    }
+
+
+class ClassroomClient:
+    def __init__(self, record):
+        from googleapiclient.discovery import build
+        from google.oauth2.credentials import Credentials
+
+        self.credentials = Credentials(
+            token=record['token'],
+            refresh_token=record.get('refresh_token'),
+            token_uri=TOKEN_URI,
+            client_id=CLIENT_ID,
+            client_secret=CLIENT_SECRET,
+            scopes=record['scopes'],
+            expiry=_expiry_from(record.get('expiry')),
+        )
+        self.saved_token = record['token']
+        self._local = threading.local()
+        self.service = build(
+            'classroom', 'v1',
+            credentials=self.credentials,
+            requestBuilder=self._build_request,
+            static_discovery=True,
+            cache_discovery=False,
+        )
+
+    def _build_request(self, http, *args, **kwargs):
+        # Swap in this thread's connection
+        import httplib2
+        from googleapiclient.http import HttpRequest
+        from google_auth_httplib2 import AuthorizedHttp
+
+        if getattr(self._local, "http", None) is None:
+            self._local.http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return HttpRequest(self._local.http, *args, **kwargs)
+
+    def sync(self, record):
+        """Adopts a newer access token stored by another worker."""
+        if record['token'] != self.saved_token:
+            self.credentials.token = record['token']
+            self.credentials.expiry = _expiry_from(record.get('expiry'))
+            self.saved_token = record['token']
+
+    def seconds_left(self):
+        """Seconds until the access token expires, or None if unknown."""
+        if self.credentials.expiry is None:
+            return None
+        return (self.credentials.expiry - _utcnow()).total_seconds()
+
+
+async def get_client(state):
+    """
+    Returns the Classroom client for a signed-in user (401 if unknown or
+    evicted), its access token refreshed if it is close to expiry.
+    """
+    record = await asyncio.to_thread(token_store.load, state)
+    if record is None:
+        _clients.pop(state, None)
+        print("[COURSES ERROR] Unknown or expired sign-in")
+        raise HTTPException(status_code=401, detail="User not authenticated. Please login again.")
+
+    client = _clients.get(state)
+    if client is None:
+        print(f"[COURSES] Building Classroom service...")
+        # discovery.build reads and parses the API document: keep it off the loop
+        client = await _run(ClassroomClient, record)
+        # a concurrent request may have built one while this one waited
+        client = _clients.setdefault(state, client)
+        while len(_clients) > CLASSROOM_MAX_CLIENTS:
+            _clients.popitem(last=False)
+    else:
+        client.sync(record)
+    _clients.move_to_end(state)
+
+    await _ensure_fresh(state, client)
+    return client
+
+
+async def _ensure_fresh(state, client):
+    left = client.seconds_left()
+    if left is None or left > TOKEN_REFRESH_MARGIN or not client.credentials.refresh_token:
+        return
+    if not client.credentials.valid:
+        await _refresh_token(state, client)
+        return
+
+    async def refresh_in_background():
+        try:
+            await _refresh_token(state, client)
+        except Exception as e:
+            print(f"[TOKENS] Background refresh failed: {type(e).__name__}")
+
+    _in_background(refresh_in_background())
+
+
+async def _refresh_token(state, client):
+    # One refresh per user at a time, however many requests notice it
+    await _flights.do(('refresh', state), lambda: _refresh(state, client))
+
+
+async def _refresh(state, client):
+    from google.auth.exceptions import RefreshError
+    from google.auth.transport.requests import Request as AuthRequest
+
+    try:
+        await _run(client.credentials.refresh, AuthRequest(session=http_client.requests_session()))
+    except RefreshError:
+        # Refresh token revoked or expired: the user has to sign in again
+        await asyncio.to_thread(token_store.delete, state)
+        _clients.pop(state, None)
+        raise HTTPException(status_code=401, detail="Google sign-in expired. Please login again.")
+    await _save_token(state, client)
+
+
+async def _save_token(state, client):
+    # Store refreshes (ours or the client library's on a 401) for every worker
+    if client.credentials.token and client.credentials.token != client.saved_token:
+        await asyncio.to_thread(token_store.save, state, _token_record(client.credentials))
+        client.saved_token = client.credentials.token
+
+
+def _list_all(list_method, key, fields=None, **params):
+    """Follows nextPageToken until the listing is exhausted (blocking)."""
+    items, page_token = [], None
+    while True:
+        kwargs = dict(params, pageSize=CLASSROOM_PAGE_SIZE)
+        if page_token:
+            kwargs['pageToken'] = page_token
+        if fields:
+            kwargs['fields'] = f"nextPageToken,{key}({fields})"
+        response = list_method(**kwargs).execute(num_retries=2)
+        items.extend(response.get(key, []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return items
+
+
+def _fingerprint(items):
+    return sorted((item.get('id'), item.get('updateTime')) for item in items)
+
+
+def _course_sources(service):
+    return [(service.courses().list, 'courses', {})]
+
+
+def _material_sources(service, course_id):
+    # courseWork needs the coursework.me scope, materials and announcements
+    # their own; all three are listed concurrently
+    return [
+        (service.courses().courseWork().list, 'courseWork', {'courseId': course_id}),
+        (service.courses().courseWorkMaterials().list, 'courseWorkMaterials', {'courseId': course_id}),
+        (service.courses().announcements().list, 'announcements', {'courseId': course_id}),
+    ]
+
+
+async def _run(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: fn(*args, **kwargs))
+
+
+async def _fetch(sources, fields=None):
+    with metrics.stage('classroom_api'):
+        results = await asyncio.gather(
+            *(_run(_list_all, method, key, fields, **params) for method, key, params in sources)
+        )
+    return {key: items for (_, key, _), items in zip(sources, results)}
+
+
+async def _revalidate(cache_key, sources, full=False):
+    entry = _listings.get(cache_key)
+    if entry is not None and not full:
+        ids = await _fetch(sources, fields="id,updateTime")
+        fingerprint = {key: _fingerprint(items) for key, items in ids.items()}
+        if fingerprint == entry['fingerprint']:
+            entry['fetched'] = time.monotonic()
+            return entry['value']
+
+    value = await _fetch(sources)
+    _listings[cache_key] = {
+        'value': value,
+        'fingerprint': {key: _fingerprint(items) for key, items in value.items()},
+        'fetched': time.monotonic(),
+    }
+    _listings.move_to_end(cache_key)
+    while len(_listings) > CLASSROOM_CACHE_MAX:
+        _listings.popitem(last=False)
+    return value
+
+
+def _revalidate_in_background(cache_key, sources, on_done):
+    async def run():
+        try:
+            await _flights.do((cache_key, False), lambda: _revalidate(cache_key, sources))
+            await on_done()
+        except Exception as e:
+            print(f"[CLASSROOM CACHE] Background revalidation failed: {e}")
+
+    _in_background(run())
+
+
+async def cached_listing(state, client, cache_key, sources, ttl, refresh=False):
+    """
+    Returns {key: items} for every (list_method, key, params) source, served
+    from the cache while fresh and revalidated in the background while stale.
+    refresh=True skips the cache and refetches everything.
+    """
+    entry = _listings.get(cache_key)
+    if entry is not None and not refresh:
+        age = time.monotonic() - entry['fetched']
+        if age < ttl:
+            _listings.move_to_end(cache_key)
+            metrics.cache_lookup('classroom', True)
+            return entry['value']
+        if age < ttl + CLASSROOM_STALE_SECONDS:
+            metrics.CACHE_LOOKUPS.labels('classroom', 'stale').inc()
+            _revalidate_in_background(cache_key, sources, lambda: _save_token(state, client))
+            return entry['value']
+
+    metrics.cache_lookup('classroom', False)
+
+    value = await _flights.do(
+        (cache_key, refresh), lambda: _revalidate(cache_key, sources, full=refresh)
+    )
+    await _save_token(state, client)
+    return value
+
+
+async def list_courses(state, refresh=False):
+    client = await get_client(state)
+    listing = await cached_listing(
+        state, client, (state, 'courses'), _course_sources(client.service),
+        CLASSROOM_COURSES_TTL, refresh,
+    )
+    return listing['courses']
+
+
+async def list_materials(state, course_id, refresh=False):
+    client = await get_client(state)
+    return await cached_listing(
+        state, client, (state, 'materials', course_id), _material_sources(client.service, course_id),
+        CLASSROOM_MATERIALS_TTL, refresh,
+    )
+
+
+async def _prefetch_courses(state, run, courses, summarize):
+    """Background job: pre-extracts every course's PDF attachments."""
+    try:
+        listings = await asyncio.gather(
+            *(list_materials(state, course['id']) for course in courses),
+            return_exceptions=True,
+        )
+        attachments = []
+        for listing in listings:
+            if not isinstance(listing, Exception):
+                attachments.extend(prefetch.pdf_attachments(listing))
+
+        await prefetch.prefetch_pdfs(run, attachments, summarize)
+    except Exception as e:
+        print(f"[PREFETCH ERROR] {str(e)}")
+    finally:
+        prefetch.finish_run(run)
 
 
 @router.get("/login")
@@ -50,7 +381,8 @@ async def google_login():
             f"state={state}"
         )
         
-        print(f"[LOGIN] Generated state: {state}")
+        await asyncio.to_thread(token_store.start_login, state)
+        print("[LOGIN] Authorization URL issued")
         
         return {"authorization_url": authorization_url, "state": state}
     
@@ -65,10 +397,11 @@ async def google_callback(code: str = Query(...), state: str = Query(...)):
     Handles the OAuth2 callback from Google
     """
     try:
-        print(f"[CALLBACK] Processing code for state: {state}")
-        
+        if not await asyncio.to_thread(token_store.finish_login, state):
+            print("[CALLBACK ERROR] Unknown or expired login state")
+            raise HTTPException(status_code=400, detail="Login expired or invalid. Please login again.")
+
         # Exchange authorization code for tokens manually
-        token_url = "https://oauth2.googleapis.com/token"
         token_data = {
             "code": code,
             "client_id": CLIENT_ID,
@@ -78,10 +411,10 @@ async def google_callback(code: str = Query(...), state: str = Query(...)):
         }
         
         print(f"[CALLBACK] Exchanging code for tokens...")
-        response = requests.post(token_url, data=token_data)
+        response = await http_client.async_client().post(TOKEN_URI, data=token_data)
         
         if response.status_code != 200:
-            print(f"[CALLBACK ERROR] Token exchange failed: {response.text}")
+            print(f"[CALLBACK ERROR] Token exchange failed ({response.status_code})")
             raise HTTPException(status_code=500, detail=f"Token exchange failed: {response.text}")
         
         token_response = response.json()
@@ -89,19 +422,16 @@ async def google_callback(code: str = Query(...), state: str = Query(...)):
         print(f"[CALLBACK] Token obtained successfully")
         print(f"[CALLBACK] Scopes granted: {token_response.get('scope', 'N/A')}")
         
-        # Store credentials
-        user_tokens[state] = {
+        # Store credentials where every worker can find them
+        expires_in = token_response.get('expires_in')
+        await asyncio.to_thread(token_store.save, state, {
             'token': token_response['access_token'],
             'refresh_token': token_response.get('refresh_token'),
-            'token_uri': 'https://oauth2.googleapis.com/token',
-            'client_id': CLIENT_ID,
-            'client_secret': CLIENT_SECRET,
-            'scopes': token_response.get('scope', '').split()
-        }
-        
-        print(f"[CALLBACK] Token stored for state: {state}")
-        print(f"[CALLBACK] Total stored tokens: {len(user_tokens)}")
-        print(f"[CALLBACK] Available states: {list(user_tokens.keys())}")
+            'scopes': token_response.get('scope', '').split(),
+            'expiry': time.time() + float(expires_in) if expires_in else None,
+        })
+
+        print(f"[CALLBACK] Token stored")
         
         return {"message": "Authentication successful", "state": state}
     
@@ -113,45 +443,83 @@ async def google_callback(code: str = Query(...), state: str = Query(...)):
 
 
 @router.get("/courses")
-async def get_courses(state: str = Query(...)):
+async def get_courses(
+    state: str = Query(...),
+    include_materials: bool = Query(False),
+    refresh: bool = Query(False),
+    prefetch_pdfs: bool = Query(False),
+    presummarize: bool = Query(False),
+):
     """
-    Fetches all courses for the authenticated user
+    Fetches all courses for the authenticated user.
+    include_materials=true also returns each course's coursework, materials
+    and announcements (fetched concurrently), so a dashboard needs one call.
+    refresh=true bypasses the cache.
+    prefetch_pdfs=true starts a background job that downloads and extracts
+    the courses' PDF attachments (and summarizes them with presummarize=true);
+    its progress is at /google/prefetch.
     """
     try:
-        print(f"[COURSES] Requesting courses for state: {state}")
-        print(f"[COURSES] Available states in memory: {list(user_tokens.keys())}")
-        
-        if state not in user_tokens:
-            print(f"[COURSES ERROR] State '{state}' not found in stored tokens")
-            raise HTTPException(status_code=401, detail="User not authenticated. Please login again.")
-        
-        # Reconstruct credentials
-        creds_data = user_tokens[state]
-        credentials = Credentials(
-            token=creds_data['token'],
-            refresh_token=creds_data['refresh_token'],
-            token_uri=creds_data['token_uri'],
-            client_id=creds_data['client_id'],
-            client_secret=creds_data['client_secret'],
-            scopes=creds_data['scopes']
-        )
-        
-        print(f"[COURSES] Building Classroom service...")
-        
-        # Build the Classroom API service
-        service = build('classroom', 'v1', credentials=credentials)
-        
         # Fetch courses
         print(f"[COURSES] Fetching courses from Google Classroom...")
-        results = service.courses().list(pageSize=100).execute()
-        courses = results.get('courses', [])
-        
+        courses = await list_courses(state, refresh)
+
+        if include_materials:
+            materials = await asyncio.gather(
+                *(list_materials(state, course['id'], refresh) for course in courses),
+                return_exceptions=True,
+            )
+            for course, result in zip(courses, materials):
+                if isinstance(result, Exception):
+                    # e.g. a course where this user lacks the coursework scope
+                    print(f"[COURSES] Materials for {course['id']} failed: {result}")
+            courses = [
+                dict(course, materials=None if isinstance(m, Exception) else m)
+                for course, m in zip(courses, materials)
+            ]
+
         print(f"[COURSES] Successfully fetched {len(courses)} courses")
-        
+
+        if prefetch_pdfs:
+            run = prefetch.start_run(state)
+            if run is not None:
+                # not BackgroundTasks: those run inside the response, which
+                # would keep this request open for the whole ingestion
+                _in_background(_prefetch_courses(state, run, courses, presummarize))
+
         return {"courses": courses}
-    
+
     except HTTPException:
         raise
     except Exception as e:
         print(f"[COURSES ERROR] {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error fetching courses: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error fetching courses: {str(e)}")
+
+
+@router.get("/courses/{course_id}/materials")
+async def get_course_materials(
+    course_id: str,
+    state: str = Query(...),
+    refresh: bool = Query(False),
+):
+    """
+    Fetches coursework, coursework materials and announcements for one course
+    """
+    try:
+        print(f"[MATERIALS] Fetching materials for course {course_id}")
+        return await list_materials(state, course_id, refresh)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[MATERIALS ERROR] {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching materials: {str(e)}")
+
+
+@router.get("/prefetch")
+async def get_prefetch_status(state: str = Query(...)):
+    """
+    Progress of the latest background prefetch for this user
+    """
+    await get_client(state)
+    return {"prefetch": prefetch.status(state)}
@@ -0,0 +1,119 @@
+import os
+import asyncio
+import threading
+
+# -----------------------------
+# Shared HTTP clients
+# -----------------------------
+# Every outbound HTTP call (PDF downloads, the OAuth token exchange and
+# refreshes) goes through one pooled async client per process, so repeat
+# calls to a host reuse a warm keep-alive connection instead of paying a new
+# TCP + TLS handshake. HTTP/2 is negotiated when the h2 package is installed
+# (pip install "httpx[http2]"); it multiplexes concurrent downloads from one
+# host over a single connection.
+#
+# Conditional requests: validators() picks the ETag / Last-Modified of a
+# response and conditional_headers() turns them into If-None-Match /
+# If-Modified-Since, so an unchanged resource comes back as a bodiless 304.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP2 = os.getenv("HTTP2", "1") == "1"
+
+_lock = threading.Lock()
+_async_client = None
+_requests_session = None
+
+
+def http2_enabled():
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _options():
+    import httpx
+
+    return dict(
+        http2=http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+
+def async_client():
+    """
+    The process-wide httpx.AsyncClient. Its connections belong to the event
+    loop that opened them, so a new loop (e.g. a fresh asyncio.run) gets a
+    new client.
+    """
+    global _async_client
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client[1] is not loop:
+        import httpx
+
+        _async_client = (httpx.AsyncClient(**_options()), loop)
+    return _async_client[0]
+
+
+def requests_session():
+    """
+    A pooled requests.Session for libraries that only speak requests
+    (google-auth's token refresh transport).
+    """
+    global _requests_session
+    if _requests_session is None:
+        with _lock:
+            if _requests_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_MAX_KEEPALIVE, pool_maxsize=HTTP_MAX_KEEPALIVE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _requests_session = session
+    return _requests_session
+
+
+async def aclose():
+    """Closes the pooled connections (server shutdown)."""
+    global _async_client, _requests_session
+    if _async_client is not None and _async_client[1] is asyncio.get_running_loop():
+        await _async_client[0].aclose()
+    _async_client = None
+    with _lock:
+        if _requests_session is not None:
+            _requests_session.close()
+            _requests_session = None
+
+
+def validators(headers):
+    """The cache validators of a response, e.g. {"etag": ..., "last_modified": ...}."""
+    found = {}
+    if headers.get("etag"):
+        found["etag"] = headers["etag"]
+    if headers.get("last-modified"):
+        found["last_modified"] = headers["last-modified"]
+    return found
+
+
+def conditional_headers(stored):
+    """If-None-Match / If-Modified-Since for validators() saved earlier."""
+    headers = {}
+    if stored.get("etag"):
+        headers["If-None-Match"] = stored["etag"]
+    if stored.get("last_modified"):
+        headers["If-Modified-Since"] = stored["last_modified"]
+    return headers
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+
+import db
+
+# -----------------------------
+# Background jobs
+# -----------------------------
+# Long generations are submitted as jobs instead of running inside the HTTP
+# request. Jobs are stored in a SQLite table (no broker needed) and executed
+# by JOB_WORKERS asyncio workers in each server process. A running job
+# refreshes its heartbeat every JOB_HEARTBEAT_SECONDS; a job whose heartbeat
+# is older than JOB_STALE_SECONDS (its process died or was restarted) is put
+# back in the queue, up to JOB_MAX_ATTEMPTS times.
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("cache", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_conn = None
+_lock = threading.Lock()
+_handlers = {}
+_workers = []
+_wakeup = None
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = db.connect(JOBS_DB_PATH, """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+        """, isolation_level=None)
+    return _conn
+
+
+def _row_to_job(row):
+    job_id, kind, payload, status, progress, result, error, attempts, created, updated = row
+    return {
+        "id": job_id,
+        "kind": kind,
+        "status": status,
+        "progress": json.loads(progress) if progress else None,
+        "result": json.loads(result) if result else None,
+        "error": error,
+        "attempts": attempts,
+        "created": created,
+        "updated": updated,
+    }
+
+
+def register(kind, handler):
+    """
+    handler(payload, report) is awaited for every job of this kind; awaiting
+    report(dict) records progress. Its return value (JSON-serializable) is the job result.
+    """
+    _handlers[kind] = handler
+
+
+def submit(kind, payload):
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _lock:
+        _connect().execute(
+            "INSERT INTO jobs (id, kind, payload, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, now, now),
+        )
+    if _wakeup is not None:
+        _wakeup.set()
+    return job_id
+
+
+def get(job_id):
+    with _lock:
+        row = _connect().execute(
+            "SELECT id, kind, payload, status, progress, result, error, attempts, created, updated"
+            " FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def _claim():
+    """Atomically moves the oldest queued job to running; None if there is none."""
+    with _lock:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                    (RUNNING, time.time(), row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return row
+
+
+def _update(job_id, **fields):
+    fields["updated"] = time.time()
+    for name in ("progress", "result"):
+        if name in fields:
+            fields[name] = json.dumps(fields[name], ensure_ascii=False)
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with _lock:
+        _connect().execute(
+            f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+        )
+
+
+def _recover():
+    """Requeues jobs whose worker stopped heartbeating; drops old finished jobs."""
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = 'Worker lost too many times', updated = ?"
+            " WHERE status = ? AND updated < ? AND attempts >= ?",
+            (FAILED, now, RUNNING, now - JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS),
+        )
+        requeued = conn.execute(
+            "UPDATE jobs SET status = ?, updated = ? WHERE status = ? AND updated < ?",
+            (QUEUED, now, RUNNING, now - JOB_STALE_SECONDS),
+        ).rowcount
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?",
+            (DONE, FAILED, now - JOB_RESULT_TTL),
+        )
+    if requeued:
+        print(f"[JOBS] Requeued {requeued} interrupted jobs")
+
+
+async def _heartbeat(job_id):
+    # Always well inside the stale window, whatever the configuration
+    interval = min(JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS / 3)
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(_update, job_id)
+
+
+async def _run(job_id, kind, payload):
+    handler = _handlers.get(kind)
+    if handler is None:
+        await asyncio.to_thread(_update, job_id, status=FAILED, error=f"Unknown job kind: {kind}")
+        return
+
+    async def report(progress):
+        await asyncio.to_thread(_update, job_id, progress=progress)
+
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    started = time.perf_counter()
+    try:
+        result = await handler(json.loads(payload), report)
+        await asyncio.to_thread(_update, job_id, status=DONE, result=result)
+        print(f"[JOBS] {kind} {job_id[:8]} done in {time.perf_counter() - started:.1f}s")
+    except asyncio.CancelledError:
+        # Server shutting down: hand the job back to the queue
+        await asyncio.to_thread(_update, job_id, status=QUEUED)
+        raise
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        print(f"[JOBS] {kind} {job_id[:8]} failed: {detail}")
+        await asyncio.to_thread(_update, job_id, status=FAILED, error=str(detail))
+    finally:
+        heartbeat.cancel()
+
+
+async def _worker():
+    while True:
+        try:
+            claimed = await asyncio.to_thread(_claim)
+        except sqlite3.OperationalError as e:  # database locked by another process
+            print(f"[JOBS] Claim failed: {e}")
+            claimed = None
+
+        if claimed is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                await asyncio.to_thread(_recover)
+            continue
+
+        await _run(*claimed)
+
+
+async def start():
+    """Recovers interrupted jobs and starts the worker pool (call on startup)."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    await asyncio.to_thread(_recover)
+    for _ in range(JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+    print(f"[JOBS] Started {JOB_WORKERS} workers")
+
+
+async def stop():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+async def watch(job_id, poll_seconds=0.5):
+    """Yields the job every time it changes, until it is done or failed."""
+    last_seen = None
+    while True:
+        job = await asyncio.to_thread(get, job_id)
+        if job is None:
+            return
+        if job["updated"] != last_seen:
+            last_seen = job["updated"]
+            yield job
+        if job["status"] in (DONE, FAILED):
+            return
+        await asyncio.sleep(poll_seconds)
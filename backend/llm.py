@@ -0,0 +1,266 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import warnings
+import threading
+import itertools
+
+from dotenv import load_dotenv
+
+import metrics
+from context import count_tokens
+
+load_dotenv()
+
+# -----------------------------
+# Shared Gemini client
+# -----------------------------
+# Every generator goes through generate() so the whole process shares one
+# model object, one requests-per-minute / tokens-per-minute budget and one
+# priority queue. Interactive chat turns are admitted ahead of bulk quiz and
+# flashcard work whenever the budget is tight, and transient errors (429,
+# 5xx, deadline) are retried with jittered exponential backoff.
+#
+# google.generativeai takes most of a second to import, so it is only
+# imported (and the model built) on the first call or by warm_up(); a
+# missing GEMINI_API_KEY fails that call, not the server start.
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 10
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BULK: "bulk"}
+
+# Output tokens reserved per call until the real usage is known
+DEFAULT_OUTPUT_TOKENS = 1024
+
+_model = None
+_retryable = ()
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """The shared GenerativeModel, configured on first use (thread-safe)."""
+    global _model, _retryable
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("GEMINI_API_KEY not found in environment variables")
+
+                # The SDK's pydantic models trigger noisy shadowing warnings
+                warnings.filterwarnings(
+                    "ignore", message="Field name .* shadows an attribute in parent .*"
+                )
+                import google.generativeai as genai
+                from google.api_core import exceptions as google_exceptions
+
+                genai.configure(api_key=api_key)
+                _retryable = (
+                    google_exceptions.ResourceExhausted,
+                    google_exceptions.ServiceUnavailable,
+                    google_exceptions.InternalServerError,
+                    google_exceptions.DeadlineExceeded,
+                )
+                _model = genai.GenerativeModel(MODEL_NAME)
+    return _model
+
+
+async def warm_up():
+    """Imports the SDK and builds the model off the event loop (no API call)."""
+    started = time.perf_counter()
+    await asyncio.to_thread(get_model)
+    print(f"[LLM] Client ready in {time.perf_counter() - started:.2f}s")
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Scheduler:
+    """
+    Admits calls in (priority, arrival) order once both buckets can pay for
+    them. A single dispatcher task owns the buckets, so there are no races.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+
+    async def acquire(self, tokens, priority):
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.get_loop() is not loop:
+            # first call, or a new event loop (e.g. a fresh asyncio.run)
+            self._heap = []
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        admitted = loop.create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), tokens, admitted))
+        self._wakeup.set()
+        await admitted
+
+    def waiting(self):
+        return len(self._heap)
+
+    async def _dispatch(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            priority, _, tokens, admitted = self._heap[0]
+            if admitted.done():  # caller was cancelled while queued
+                heapq.heappop(self._heap)
+                continue
+
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait <= 0:
+                heapq.heappop(self._heap)
+                self.requests.take(1)
+                self.tokens.take(tokens)
+                admitted.set_result(None)
+                continue
+
+            # Sleep until the budget refills, or until a new (possibly more
+            # urgent) caller arrives
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = Scheduler(GEMINI_RPM, GEMINI_TPM)
+metrics.LLM_QUEUED.set_function(scheduler.waiting)
+
+
+def _backoff(attempt):
+    # "Full jitter": uniform over [0, capped exponential]
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+
+
+async def generate(prompt, priority=PRIORITY_NORMAL, generation_config=None, stream=False,
+                   output_tokens=DEFAULT_OUTPUT_TOKENS):
+    """
+    Rate-limited, retried model.generate_content_async. Returns the SDK
+    response (an async iterator of chunks when stream=True; only opening
+    the stream is retried).
+    """
+    reserved = count_tokens(prompt) + output_tokens
+    model = _model or await asyncio.to_thread(get_model)
+
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        with metrics.stage("llm_wait"):
+            await scheduler.acquire(reserved, priority)
+        try:
+            with metrics.stage("llm_call"), metrics.LLM_IN_FLIGHT.track_inprogress():
+                response = await model.generate_content_async(
+                    prompt, generation_config=generation_config, stream=stream
+                )
+        except _retryable as e:
+            if attempt == GEMINI_MAX_RETRIES:
+                _failed(e, priority)
+                raise
+            metrics.LLM_RETRIES.labels(type(e).__name__).inc()
+            delay = _backoff(attempt)
+            print(f"[LLM] {type(e).__name__}, retry {attempt + 1}/{GEMINI_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        except Exception as e:
+            _failed(e, priority)
+            raise
+
+        metrics.LLM_CALLS.labels(_PRIORITY_NAMES.get(priority, str(priority)), "ok").inc()
+        if stream:
+            return _counted(response)
+        _settle(response, reserved)
+        return response
+
+
+def _failed(error, priority):
+    metrics.LLM_CALLS.labels(_PRIORITY_NAMES.get(priority, str(priority)), "error").inc()
+    metrics.LLM_ERRORS.labels(type(error).__name__).inc()
+
+
+def _count_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        metrics.LLM_TOKENS.labels("prompt").inc(getattr(usage, "prompt_token_count", 0) or 0)
+        metrics.LLM_TOKENS.labels("output").inc(getattr(usage, "candidates_token_count", 0) or 0)
+    return usage
+
+
+async def _counted(stream):
+    """
+    Passes a response stream through, counting tokens from its last usage
+    report. Closing it early (aclose) closes the SDK stream as well.
+    """
+    chunks = aiter(stream)
+    last = None
+    try:
+        async for chunk in chunks:
+            last = chunk
+            yield chunk
+    finally:
+        if last is not None:
+            _count_usage(last)
+        await _close_stream(chunks)
+        # the SDK response keeps the underlying gRPC / REST stream here
+        await _close_stream(getattr(stream, "_iterator", None))
+
+
+async def _close_stream(iterator):
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+    elif hasattr(iterator, "cancel"):
+        iterator.cancel()
+
+
+def _settle(response, reserved):
+    """Returns over-reserved tokens to the budget once real usage is known."""
+    usage = _count_usage(response)
+    used = getattr(usage, "total_token_count", 0) if usage else 0
+    if used and used < reserved:
+        scheduler.tokens.give_back(reserved - used)
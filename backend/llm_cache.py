@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+
+import db
+import metrics
+from singleflight import SingleFlight
+
+# -----------------------------
+# Persistent Gemini response cache
+# -----------------------------
+# Results are keyed by a hash of the model name, the prompt template version
+# and the generator inputs, so bumping a module's PROMPT_VERSION is enough to
+# invalidate everything produced by an older prompt.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm.sqlite3"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+_conn = None
+_lock = threading.Lock()
+_writes = 0
+_flights = SingleFlight("llm")
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = db.connect(LLM_CACHE_PATH, """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+        """)
+    return _conn
+
+
+def cache_key(model_name, prompt_version, **inputs):
+    payload = json.dumps(
+        {"model": model_name, "version": prompt_version, "inputs": inputs},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key):
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > LLM_CACHE_TTL:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        conn.commit()
+    return json.loads(row[0])
+
+
+def put(key, value):
+    global _writes
+    now = time.time()
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now, now),
+        )
+        conn.commit()
+        _writes += 1
+        if _writes % 50 == 0:
+            _evict(conn, now)
+
+
+def _evict(conn, now):
+    """Drops expired rows, then the least recently used past LLM_CACHE_MAX_ENTRIES."""
+    conn.execute("DELETE FROM responses WHERE created < ?", (now - LLM_CACHE_TTL,))
+    conn.execute("""
+        DELETE FROM responses WHERE key IN (
+            SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )
+    """, (LLM_CACHE_MAX_ENTRIES,))
+    conn.commit()
+
+
+async def cached(key, compute, bypass=False):
+    """
+    Returns the stored result for `key`, or awaits compute() and stores it.
+    bypass=True ("regenerate") skips the lookup but still refreshes the entry.
+    Empty results are never stored so a failed generation is retried next time.
+    Identical concurrent calls are coalesced into one lookup/generation.
+    """
+    return await _flights.do((key, bypass), lambda: _cached(key, compute, bypass))
+
+
+async def _cached(key, compute, bypass):
+    if not bypass:
+        hit = await asyncio.to_thread(get, key)
+        metrics.cache_lookup("llm", hit is not None)
+        if hit is not None:
+            print(f"[LLM CACHE] Hit {key[:12]}")
+            return hit
+
+    value = await compute()
+    if value:
+        await asyncio.to_thread(put, key, value)
+    return value
@@ -1,13 +1,46 @@
-from fastapi import FastAPI
+import time
+
+# Startup time is measured from here, see report_startup()
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, Response
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional
 import os
-from pdf_utils import extract_text_from_pdf_url
-from gemini import summarize_text
+import json
+import asyncio
+import importlib
+from contextlib import contextmanager
+from pdf_utils import (
+    extract_pages_from_pdf_url_async,
+    content_hash_for_url,
+    join_pages,
+    PDFTooLargeError,
+    PDFNoTextError,
+)
+from gemini import (
+    summarize_text, summarize_document, summarize_pdf_url, stream_summary, SUMMARY_CONTEXT_TOKENS,
+)
 from dotenv import load_dotenv
-from flashcards import generate_flashcards
-from quiz import generate_quiz
-from mention import get_response
+from flashcards import (
+    generate_flashcards, generate_flashcards_batched, generate_more_flashcards, card_key,
+    FLASHCARDS_CONTEXT_TOKENS,
+)
+from quiz import (
+    generate_quiz, generate_quiz_batched, generate_more_quiz, question_key, QUIZ_CONTEXT_TOKENS,
+)
+from context import select_context, CONTEXT_SOURCE_CHARS
+from batching import BATCH_SIZE
+from mention import get_response, compact_memory
+import llm
+import metrics
+import artifacts
+import http_client
+import sessions
+import jobs
+from retrieval import retrieve, format_passages
 from fastapi import HTTPException
 
 # Load environment variables
@@ -28,6 +61,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-route latency and in-flight requests, exported on /metrics
+app.add_middleware(metrics.MetricsMiddleware, routes=app.routes)
 
 
 # UPLOAD_DIR = "uploads"
@@ -38,101 +73,565 @@ app.add_middleware(
 def root():
     return {"status": "backend running"}
 
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 
 
 class SummarizeRequest(BaseModel):
     fileURL: str
     user_prompt: str
+    # map-reduce over every page even when the document would fit the
+    # context budget (longer documents always get it)
+    full_document: bool = False
+    regenerate: bool = False  # skip the response cache
+
+# Most flashcards / questions one request may ask for: anything over
+# BATCH_SIZE fans out into one Gemini call per batch
+MAX_ITEMS = int(os.getenv("GENERATION_MAX_ITEMS", "50"))
 
 class FlashcardsRequest(BaseModel):
     fileURL: str
-    n_cards: int = 10  # default to 10 flashcards if not specified
+    n_cards: int = Field(10, ge=1, le=MAX_ITEMS)  # default to 10 flashcards if not specified
+    regenerate: bool = False
 
 class QuizRequest(BaseModel):
     fileURL: str
-    n_questions: int = 5  # default to 5 questions if not specified
+    n_questions: int = Field(5, ge=1, le=MAX_ITEMS)  # default to 5 questions if not specified
+    regenerate: bool = False
+
+class StudyPackRequest(BaseModel):
+    fileURL: str
+    user_prompt: str = ""
+    n_cards: int = Field(10, ge=1, le=MAX_ITEMS)
+    n_questions: int = Field(5, ge=1, le=MAX_ITEMS)
+    full_document: bool = False  # map-reduce summary over every page
+    regenerate: bool = False
+
+class PageRequest(BaseModel):
+    fileURL: str
+    offset: int = 0  # items the client has already been served
+    limit: int = 10
 
 class ChatbotRequest(BaseModel):
     user_prompt: str
     memory: str = ""
+    fileURLs: list[str] = []  # course PDFs to answer from
+    # Server-side memory: send "" to start a session, then the returned id.
+    # When set, `memory` is ignored.
+    session_id: Optional[str] = None
+
+def _session(session_id):
+    """
+    The chat session for session_id ("" starts one). Sessions are kept per
+    process, so this needs a single worker (or sticky routing).
+    """
+    session = sessions.get_session(session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Unknown or expired session_id; send "" to start a new session',
+        )
+    return session
+
+async def _extract_context(file_url, max_tokens, query=None):
+    """
+    Extracts up to CONTEXT_SOURCE_CHARS of the PDF (later pages are never
+    parsed) and packs its most salient sections into max_tokens.
+    """
+    pages = await extract_pages_from_pdf_url_async(file_url, max_chars=CONTEXT_SOURCE_CHARS)
+    return await asyncio.to_thread(select_context, pages, max_tokens, query)
+
+async def _stored(file_url, kind, key, coro):
+    """Awaits a flashcard/quiz generation and keeps its items in the artifact store."""
+    items = await coro
+    doc = await asyncio.to_thread(content_hash_for_url, file_url)
+    await artifacts.record(doc, kind, items, key)
+    return items
+
+@contextmanager
+def _http_errors():
+    """
+    Turns a failed request into its HTTP error: 400 for a PDF without text,
+    413 for an oversized PDF, 500 for anything unexpected.
+    """
+    try:
+        yield
+    except HTTPException:
+        raise
+    except PDFNoTextError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PDFTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        print("ERROR:", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _summarize(request: SummarizeRequest, priority=llm.PRIORITY_NORMAL):
+    summary, full_document = await summarize_pdf_url(
+        request.fileURL, request.user_prompt, full_document=request.full_document,
+        regenerate=request.regenerate, priority=priority,
+    )
+
+    # full_document: False means the summary came from the most salient
+    # sections of a document short enough to fit the context budget
+    return {"summary": summary, "full_document": full_document}
 
 @app.post("/summarize")
 async def summarize_pdf(request: SummarizeRequest):
-    try:
-        print(request)
-        text = extract_text_from_pdf_url(request.fileURL)
-        user_prompt = request.user_prompt
+    print(request)
+    with _http_errors():
+        return await _summarize(request)
+
+def sse_event(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+def sse_response(events):
+    """Streams sse_event() messages; proxies are told not to buffer or cache them."""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/summarize/stream")
+async def summarize_pdf_stream(request: SummarizeRequest, http_request: Request):
+    """
+    Server-Sent Events variant of /summarize: each `data:` event carries the
+    next piece of summary text, followed by a final `done` event. Streaming
+    always uses the single budgeted call; `done` carries truncated=true when
+    the document went past CONTEXT_SOURCE_CHARS (/summarize covers it all).
+    """
+    with _http_errors():
+        pages = await extract_pages_from_pdf_url_async(request.fileURL, max_chars=CONTEXT_SOURCE_CHARS)
+        truncated = len(join_pages(pages)) >= CONTEXT_SOURCE_CHARS
+        text = await asyncio.to_thread(
+            select_context, pages, SUMMARY_CONTEXT_TOKENS, request.user_prompt
+        )
         if not text.strip():
             raise HTTPException(status_code=400, detail="No text found in PDF")
 
-        text = text[:10000]
-        summary = summarize_text(text, user_prompt)
+    async def events():
+        chunks = stream_summary(text, request.user_prompt, regenerate=request.regenerate)
+        try:
+            async for chunk in chunks:
+                if await http_request.is_disconnected():
+                    print("[SUMMARIZE STREAM] Client disconnected, cancelling")
+                    break
+                yield sse_event({"text": chunk})
+            else:
+                yield sse_event({"truncated": truncated}, event="done")
+        except Exception as e:
+            print("ERROR:", e)
+            yield sse_event({"detail": str(e)}, event="error")
+        finally:
+            await chunks.aclose()
+
+    return sse_response(events())
+
+async def _flashcards(request: FlashcardsRequest, priority=llm.PRIORITY_NORMAL):
+    if request.n_cards > BATCH_SIZE:
+        # big decks draw batches from across the whole document
+        pages = await extract_pages_from_pdf_url_async(request.fileURL)
+        if not join_pages(pages).strip():
+            raise HTTPException(status_code=400, detail="No text found in PDF")
+        cards = await _stored(request.fileURL, "flashcards", card_key, generate_flashcards_batched(
+            pages, request.n_cards, regenerate=request.regenerate
+        ))
+        return {"flashcards": cards}
 
-        return {"summary": summary}
+    # limit tokens but keep coverage; pages past the budget are never parsed
+    text = await _extract_context(request.fileURL, FLASHCARDS_CONTEXT_TOKENS)
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="No text found in PDF")
 
-    except Exception as e:
-        print("ERROR:", e)
-        raise HTTPException(status_code=500, detail=str(e))
+    cards = await _stored(request.fileURL, "flashcards", card_key, generate_flashcards(
+        text, n_cards=request.n_cards, regenerate=request.regenerate, priority=priority
+    ))
+
+    return {"flashcards": cards}
 
 @app.post("/flashcards")
 async def flashcards(request: FlashcardsRequest):
-    try:
-        text = extract_text_from_pdf_url(request.fileURL)
-        if not text.strip():
+    with _http_errors():
+        return await _flashcards(request)
+
+async def _quiz(request: QuizRequest, priority=llm.PRIORITY_NORMAL):
+    if request.n_questions > BATCH_SIZE:
+        # big quizzes draw batches from across the whole document
+        pages = await extract_pages_from_pdf_url_async(request.fileURL)
+        if not join_pages(pages).strip():
             raise HTTPException(status_code=400, detail="No text found in PDF")
+        quiz_data = await _stored(request.fileURL, "quiz", question_key, generate_quiz_batched(
+            pages, request.n_questions, regenerate=request.regenerate
+        ))
+        return {"quiz": quiz_data}
 
-        # limit tokens but keep coverage
-        text = text[:12000]
+    text = await _extract_context(request.fileURL, QUIZ_CONTEXT_TOKENS)
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="No text found in PDF")
 
-        cards = generate_flashcards(text, n_cards=request.n_cards)
+    print(f"DEBUG: Extracting quiz from {len(text)} chars...")
 
-        return {"flashcards": cards}
+    # Generate Quiz
+    quiz_data = await _stored(request.fileURL, "quiz", question_key, generate_quiz(
+        text, n_questions=request.n_questions, regenerate=request.regenerate, priority=priority
+    ))
 
-    except Exception as e:
-        print("ERROR:", e)
-        raise HTTPException(status_code=500, detail=str(e))
+    return {"quiz": quiz_data}
 
 @app.post("/quiz")
 async def quiz_endpoint(request: QuizRequest):
-    try:
-        text = extract_text_from_pdf_url(request.fileURL)
-        if not text.strip():
+    with _http_errors():
+        return await _quiz(request)
+
+# -----------------------------
+# Paging through stored artifacts
+# -----------------------------
+# "More questions": serves the items of a document the client has not seen
+# yet from the artifact store, generating only what is missing.
+PAGE_MAX_ITEMS = MAX_ITEMS
+
+ARTIFACT_GENERATORS = {
+    "flashcards": (generate_more_flashcards, card_key),
+    "quiz": (generate_more_quiz, question_key),
+}
+
+async def _page(request: PageRequest, kind):
+    if request.offset < 0 or not 1 <= request.limit <= PAGE_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"offset must be >= 0 and limit between 1 and {PAGE_MAX_ITEMS}"
+        )
+
+    doc = await asyncio.to_thread(content_hash_for_url, request.fileURL)
+    if doc is None:
+        # never downloaded before; extracting records its content hash
+        await extract_pages_from_pdf_url_async(request.fileURL, max_chars=CONTEXT_SOURCE_CHARS)
+        doc = await asyncio.to_thread(content_hash_for_url, request.fileURL)
+
+    # pages are served in order: skipping ahead would generate everything in between
+    stored = await asyncio.to_thread(artifacts.count, doc, kind)
+    if request.offset > stored:
+        raise HTTPException(
+            status_code=400, detail=f"offset must not exceed the {stored} items served so far"
+        )
+
+    generate_more, key = ARTIFACT_GENERATORS[kind]
+
+    async def generate(n, exclude, start):
+        # only a page that is not fully stored pays for the whole document
+        pages = await extract_pages_from_pdf_url_async(request.fileURL)
+        if not join_pages(pages).strip():
             raise HTTPException(status_code=400, detail="No text found in PDF")
+        return await generate_more(pages, n, exclude, start)
 
-        print(f"DEBUG: Extracting quiz from {len(text)} chars...")
+    items, total = await artifacts.page(doc, kind, request.offset, request.limit, generate, key)
+    return {
+        kind: items,
+        "offset": request.offset,
+        "next_offset": request.offset + len(items),
+        "total": total,
+    }
 
-        # Generate Quiz
-        quiz_data = generate_quiz(text, n_questions=request.n_questions)
+@app.post("/flashcards/page")
+async def flashcards_page(request: PageRequest):
+    """Flashcards [offset, offset + limit) of the document's deck."""
+    with _http_errors():
+        return await _page(request, "flashcards")
+
+@app.post("/quiz/page")
+async def quiz_page(request: PageRequest):
+    """Quiz questions [offset, offset + limit) of the document's question bank."""
+    with _http_errors():
+        return await _page(request, "quiz")
+
+async def _study_pack_tasks(request: StudyPackRequest, priority=llm.PRIORITY_NORMAL):
+    """
+    Extracts the PDF once and returns the three generation coroutines,
+    keyed by artifact name, all working from that single extraction.
+    Batched decks and quizzes always run at bulk priority.
+    """
+    batched = request.n_cards > BATCH_SIZE or request.n_questions > BATCH_SIZE
+    budget = None if request.full_document or batched else CONTEXT_SOURCE_CHARS
+    pages = await extract_pages_from_pdf_url_async(request.fileURL, max_chars=budget)
+    if not join_pages(pages).strip():
+        raise HTTPException(status_code=400, detail="No text found in PDF")
+
+    if request.full_document:
+        summary = summarize_document(
+            pages, request.user_prompt, regenerate=request.regenerate, priority=priority
+        )
+    else:
+        summary_text = await asyncio.to_thread(
+            select_context, pages, SUMMARY_CONTEXT_TOKENS, request.user_prompt
+        )
+        summary = summarize_text(
+            summary_text, request.user_prompt, regenerate=request.regenerate, priority=priority
+        )
+
+    if request.n_cards > BATCH_SIZE:
+        flashcards = generate_flashcards_batched(pages, request.n_cards, regenerate=request.regenerate)
+    else:
+        flashcards = generate_flashcards(
+            await asyncio.to_thread(select_context, pages, FLASHCARDS_CONTEXT_TOKENS),
+            n_cards=request.n_cards,
+            regenerate=request.regenerate,
+            priority=priority,
+        )
+
+    if request.n_questions > BATCH_SIZE:
+        quiz = generate_quiz_batched(pages, request.n_questions, regenerate=request.regenerate)
+    else:
+        quiz = generate_quiz(
+            await asyncio.to_thread(select_context, pages, QUIZ_CONTEXT_TOKENS),
+            n_questions=request.n_questions,
+            regenerate=request.regenerate,
+            priority=priority,
+        )
 
-        return {"quiz": quiz_data}
+    return {
+        "summary": summary,
+        "flashcards": _stored(request.fileURL, "flashcards", card_key, flashcards),
+        "quiz": _stored(request.fileURL, "quiz", question_key, quiz),
+    }
 
+async def _named(name, coro):
+    try:
+        return name, await coro, None
     except Exception as e:
-        print("ERROR:", e)
-        raise HTTPException(status_code=500, detail=str(e))
+        return name, None, e
+
+async def _collect_study_pack(tasks, on_ready=None):
+    """
+    Awaits the study-pack coroutines concurrently; await on_ready(name) runs
+    as each artifact finishes. Failed artifacts are listed under "errors".
+    """
+    pending = [asyncio.ensure_future(_named(name, coro)) for name, coro in tasks.items()]
+    results, errors = {}, {}
+    try:
+        for next_done in asyncio.as_completed(pending):
+            name, result, error = await next_done
+            if error is not None:
+                print(f"ERROR ({name}):", error)
+                errors[name] = str(error)
+            results[name] = result
+            if on_ready is not None:
+                await on_ready(name)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    pack = {name: results.get(name) for name in tasks}
+    if errors:
+        pack["errors"] = errors
+    return pack
+
+@app.post("/study-pack")
+async def study_pack(request: StudyPackRequest):
+    """
+    Summary, flashcards and quiz for one fileURL from a single download and
+    extraction, with the three Gemini calls running concurrently.
+    An artifact that fails is reported under "errors" instead of failing the rest.
+    """
+    with _http_errors():
+        tasks = await _study_pack_tasks(request)
+    return await _collect_study_pack(tasks)
+
+@app.post("/study-pack/stream")
+async def study_pack_stream(request: StudyPackRequest):
+    """
+    Progressive /study-pack: one SSE event per artifact (event name is the
+    artifact) as soon as it is ready, then a final `done` event.
+    """
+    with _http_errors():
+        tasks = await _study_pack_tasks(request)
+
+    async def events():
+        pending = [asyncio.ensure_future(_named(name, coro)) for name, coro in tasks.items()]
+        try:
+            for next_done in asyncio.as_completed(pending):
+                name, result, error = await next_done
+                if error is not None:
+                    print(f"ERROR ({name}):", error)
+                    yield sse_event({"detail": str(error)}, event=f"{name}-error")
+                else:
+                    yield sse_event(result, event=name)
+            yield sse_event({}, event="done")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    return sse_response(events())
 
 @app.post("/mention")
 async def mention(payload: dict):
+    """
+    With "session_id" ("" to start), chat memory is kept server-side in this
+    worker's memory: deploy chat on a single worker (or with sticky
+    sessions). An unknown or expired id is a 404.
+    """
     text = payload["text"]
     memory = payload.get("memory", "")
 
-    answer, summary = get_response(text, memory)
+    session = None
+    if payload.get("session_id") is not None:
+        session = _session(payload["session_id"])
+        memory = sessions.memory_for_prompt(session)
+
+    passages = await retrieve(payload.get("fileURLs", []), text)
+    answer, summary = await get_response(text, memory, context=format_passages(passages))
 
+    if session is None:
+        return {
+            "response": answer,
+            "summary": summary
+        }
+
+    sessions.remember(session, summary, compact_memory)
     return {
         "response": answer,
-        "summary": summary
+        "summary": summary,
+        "session_id": session.id
     }
 
 @app.post("/chatbot")
 async def chatbot(request: ChatbotRequest):
-    try:
-        answer, summary = get_response(request.user_prompt, request.memory)
+    """
+    With session_id ("" to start), chat memory is kept server-side in this
+    worker's memory: deploy chat on a single worker (or with sticky
+    sessions). An unknown or expired id is a 404.
+    """
+    with _http_errors():
+        session = None
+        memory = request.memory
+        if request.session_id is not None:
+            session = _session(request.session_id)
+            memory = sessions.memory_for_prompt(session)
+
+        passages = await retrieve(request.fileURLs, request.user_prompt)
+        answer, summary = await get_response(
+            request.user_prompt, memory, context=format_passages(passages)
+        )
+
+        if session is None:
+            return {
+                "response": answer,
+                "summary": summary
+            }
+
+        sessions.remember(session, summary, compact_memory)
         return {
             "response": answer,
-            "summary": summary
+            "summary": summary,
+            "session_id": session.id
         }
-    except Exception as e:
-        print("ERROR:", e)
-        raise HTTPException(status_code=500, detail=str(e))
+
+# -----------------------------
+# Background jobs
+# -----------------------------
+# POST /jobs runs a summarize / flashcards / quiz / study-pack request on the
+# local worker pool instead of inside the HTTP request; poll GET /jobs/{id}
+# or follow GET /jobs/{id}/events for progress and the result.
+# Jobs are nobody's live request, so their Gemini calls run at bulk priority.
+JOB_REQUESTS = {
+    "summarize": SummarizeRequest,
+    "flashcards": FlashcardsRequest,
+    "quiz": QuizRequest,
+    "study-pack": StudyPackRequest,
+}
+
+class JobRequest(BaseModel):
+    kind: str  # one of JOB_REQUESTS
+    payload: dict  # the body the matching endpoint would take
+
+def _job_handler(model, run):
+    async def handler(payload, report):
+        request = model(**payload)
+        await report({"stage": "running"})
+        return await run(request, priority=llm.PRIORITY_BULK)
+    return handler
+
+async def _study_pack_job(payload, report):
+    request = StudyPackRequest(**payload)
+    await report({"stage": "extracting"})
+    tasks = await _study_pack_tasks(request, priority=llm.PRIORITY_BULK)
+
+    ready = []
+    await report({"stage": "generating", "ready": ready})
+
+    async def on_ready(name):
+        ready.append(name)
+        await report({"stage": "generating", "ready": ready})
+
+    return await _collect_study_pack(tasks, on_ready)
+
+jobs.register("summarize", _job_handler(SummarizeRequest, _summarize))
+jobs.register("flashcards", _job_handler(FlashcardsRequest, _flashcards))
+jobs.register("quiz", _job_handler(QuizRequest, _quiz))
+jobs.register("study-pack", _study_pack_job)
+
+@app.on_event("startup")
+async def start_jobs():
+    await jobs.start()
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    # running jobs go back to the queue for the next start
+    await jobs.stop()
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await http_client.aclose()
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    model = JOB_REQUESTS.get(request.kind)
+    if model is None:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown job kind, expected one of {list(JOB_REQUESTS)}"
+        )
+    try:
+        model(**request.payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+
+    job_id = await asyncio.to_thread(jobs.submit, request.kind, request.payload)
+    return {"job_id": job_id, "status": jobs.QUEUED}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request):
+    """
+    SSE: a `progress` event whenever the job changes, then `done` (with the
+    result) or `error`.
+    """
+    if await asyncio.to_thread(jobs.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for job in jobs.watch(job_id):
+            if await http_request.is_disconnected():
+                break
+            if job["status"] == jobs.DONE:
+                yield sse_event(job["result"], event="done")
+            elif job["status"] == jobs.FAILED:
+                yield sse_event({"detail": job["error"]}, event="error")
+            else:
+                yield sse_event(
+                    {"status": job["status"], "progress": job["progress"]}, event="progress"
+                )
+
+    return sse_response(events())
 
 # Add this import at the top
 from google_classroom import router as google_router
@@ -140,3 +639,40 @@ from google_classroom import router as google_router
 # Add this line where you create your FastAPI app
 # (after app = FastAPI())
 app.include_router(google_router)
+
+
+# -----------------------------
+# Startup
+# -----------------------------
+# The heavy SDKs (google-generativeai, pdfplumber, numpy, the Google API
+# client) are imported on first use so a worker is ready quickly.
+# WARM_UP=1 loads them, and builds the Gemini client, in the background
+# right after startup so the first request does not pay for them either;
+# readiness never waits for the warm-up.
+WARM_UP = os.getenv("WARM_UP", "0") == "1"
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "1.0"))
+WARM_UP_MODULES = ("pdfplumber", "numpy", "httpx", "googleapiclient.discovery")
+
+_warm_up_task = None
+
+def _import_warm_up_modules():
+    for name in WARM_UP_MODULES:
+        importlib.import_module(name)
+
+async def _warm_up():
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(llm.warm_up(), asyncio.to_thread(_import_warm_up_modules))
+        print(f"[STARTUP] Warm-up finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"[STARTUP] Warm-up failed: {e}")
+
+@app.on_event("startup")
+async def report_startup():
+    # registered last, so this runs after every other startup handler
+    global _warm_up_task
+    elapsed = time.perf_counter() - _IMPORT_STARTED
+    status = "within" if elapsed <= STARTUP_BUDGET_SECONDS else "OVER"
+    print(f"[STARTUP] Ready in {elapsed:.2f}s ({status} the {STARTUP_BUDGET_SECONDS:.2f}s budget)")
+    if WARM_UP:
+        _warm_up_task = asyncio.create_task(_warm_up())
@@ -65,19 +65,25 @@
 
 #     return answer, summary
 
-import os
-import json
-from google import genai
-from google.genai import types
+import llm
+import metrics
+import structured
 
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "response": {"type": "string"},
+        "summary": {"type": "string"}
+    },
+    "required": ["response", "summary"]
+}
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
-
-def get_response(text: str, memory: str = ""):
+async def get_response(text: str, memory: str = "", context: str = ""):
     """
-    text   : current @AI mention message
-    memory : privacy-safe summary from previous turns
+    text    : current @AI mention message
+    memory  : privacy-safe summary from previous turns
+    context : retrieved course-material passages (may be empty)
     """
 
     prompt = f"""
@@ -87,52 +93,62 @@ def get_response(text: str, memory: str = ""):
         - Respect privacy
         - Do NOT include usernames or personal details
         - Use only the provided summary as memory
+        - When course material is provided, base the answer on it and cite pages as (p. N)
 
         Previous context summary:
         {memory if memory else "None"}
 
+        Course material:
+        {context if context else "None"}
+
 Current Question:
 {text}
 
 Provide a helpful educational response and create a brief privacy-safe summary (max 2 sentences) of only the new academic content discussed."""
 
-    try:
-        # Use JSON mode for reliable structured output
-        response = client.models.generate_content(
-            model="gemini-flash-latest",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.7,
-                response_mime_type="application/json",
-                response_schema={
-                    "type": "object",
-                    "properties": {
-                        "response": {"type": "string"},
-                        "summary": {"type": "string"}
-                    },
-                    "required": ["response", "summary"]
-                }
-            )
-        )
-        
-        result = json.loads(response.text)
-        answer = result.get("response", "I apologize, I couldn't generate a response.")
-        summary = result.get("summary", "Unable to generate summary.")
-        
-    except (json.JSONDecodeError, Exception) as e:
-        # Fallback to text parsing if JSON fails
-        print(f"JSON parsing failed: {e}, falling back to text parsing")
-        
-        response = client.models.generate_content(
-            model="gemini-flash-latest",
-            contents=prompt + "\n\nFormat: RESPONSE:\n<response>\n\nSUMMARY:\n<summary>"
-        )
-        
-        answer, summary = parse_output(response.text.strip())
-    
+    # JSON mode; a truncated or malformed object is repaired locally
+    # instead of paying for a second call
+    raw = await structured.generate_json(
+        prompt, RESPONSE_SCHEMA, llm.PRIORITY_INTERACTIVE, temperature=0.7
+    )
+
+    with metrics.stage("parse"):
+        result = structured.parse_json_object(raw)
+        if result and result.get("response"):
+            answer = result["response"]
+            summary = result.get("summary") or "No new information to summarize."
+        else:
+            print("JSON parsing failed, falling back to text parsing")
+            answer, summary = parse_output(raw.strip())
+
     return answer, summary
 
 
+async def compact_memory(memory: str, max_tokens: int):
+    """
+    Condenses accumulated conversation summaries into one privacy-safe
+    summary of roughly max_tokens tokens.
+    """
+    prompt = f"""
+        You maintain the long-term memory of a study group chat.
+
+        Condense the notes below into a single privacy-safe summary of at most
+        {max_tokens * 3 // 4} words. Keep the academic topics, definitions and open
+        questions; drop repetition. Do NOT include usernames or personal details.
+
+        Notes:
+        {memory}
+        """
+
+    # Runs in the background, so it yields to live chat turns
+    response = await llm.generate(
+        prompt,
+        llm.PRIORITY_BULK,
+        generation_config={"temperature": 0.2},
+    )
+    return response.text.strip()
+
+
 def parse_output(text: str):
     """Fallback parser for non-JSON responses."""
     answer = ""
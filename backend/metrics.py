@@ -0,0 +1,126 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from starlette.routing import Match
+
+# -----------------------------
+# Prometheus metrics
+# -----------------------------
+# One place for every metric the backend exports on /metrics. Recording is a
+# couple of dict lookups and a lock per observation, cheap enough to leave
+# on around every stage of every request:
+#   - request_duration_seconds / requests_in_flight: per route, from the
+#     ASGI middleware below (streaming responses are timed to their last byte)
+#   - stage_duration_seconds: download, extract, select_context, prompt,
+#     llm_wait (rate-limit queue), llm_call and parse
+#   - cache_lookups_total: hit/miss per cache, so hit ratios are one division
+#   - llm_*: calls, tokens, retries and errors by exception type
+
+# Stages range from sub-millisecond (prompt) to tens of seconds (llm_call)
+_STAGE_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+)
+
+REQUEST_SECONDS = Histogram(
+    "request_duration_seconds", "HTTP request latency", ["method", "route", "status"],
+    buckets=_STAGE_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "requests_in_flight", "HTTP requests being served", ["method", "route"],
+)
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds", "Time spent per processing stage", ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"],
+)
+COALESCED = Counter(
+    "singleflight_joined_total", "Calls that joined identical in-flight work", ["name"],
+)
+IN_FLIGHT_WORK = Gauge(
+    "singleflight_in_flight", "Distinct units of work in flight", ["name"],
+)
+LLM_CALLS = Counter(
+    "llm_calls_total", "Gemini calls by priority and outcome", ["priority", "outcome"],
+)
+LLM_IN_FLIGHT = Gauge("llm_calls_in_flight", "Gemini calls awaiting a response")
+LLM_QUEUED = Gauge("llm_calls_queued", "Gemini calls waiting for rate-limit budget")
+LLM_TOKENS = Counter("llm_tokens_total", "Gemini tokens used", ["kind"])
+LLM_RETRIES = Counter("llm_retries_total", "Retried Gemini errors", ["error"])
+LLM_ERRORS = Counter("llm_errors_total", "Gemini calls that failed for good", ["error"])
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def stage(name):
+    """Times the enclosed block into stage_duration_seconds{stage=name}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def cache_lookup(cache, hit):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def render():
+    return generate_latest()
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware: BaseHTTPMiddleware returns at the response
+    headers, which would time the SSE streams to their first byte.
+    Requests are labelled by route template, e.g. /jobs/{job_id}, so label
+    cardinality stays bounded; paths matching no route share one label.
+    """
+
+    def __init__(self, app, routes=()):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, _match(self.routes, scope))
+        in_flight.inc()
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            # routing records the matched route in the scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_SECONDS.labels(method, route, str(status)).observe(
+                time.perf_counter() - started
+            )
+
+
+def _match(routes, scope):
+    """Template of the route that will serve `scope`, looking inside included routers."""
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.NONE:
+            continue
+        path = getattr(route, "path", None)
+        if path is not None:
+            return path
+        # FastAPI keeps included routers as one entry
+        router = getattr(route, "original_router", route)
+        return _match(getattr(router, "routes", ()), scope)
+    return "unmatched"
@@ -1,25 +1,613 @@
-import requests
 import io
-import pdfplumber
+import os
+import re
+import mmap
+import math
+import tempfile
+import multiprocessing
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import metrics
+import http_client
+from singleflight import SingleFlight
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-def extract_text_from_pdf(file_path):
-    text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-    return text
+# -----------------------------
+# On-disk extraction cache
+# -----------------------------
+# Extracted page text is stored once per unique PDF (keyed by the SHA-256 of
+# its bytes); a small URL index maps fileURLs to those content hashes so a
+# repeat request skips both the download and the pdfplumber pass. The index
+# also keeps the server's ETag / Last-Modified: once a URL's entry is older
+# than PDF_REVALIDATE_SECONDS it is revalidated with a conditional GET, and
+# a 304 serves the cached text without downloading the file again.
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join("cache", "pdf"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+PDF_CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", "1000"))
+PDF_REVALIDATE_SECONDS = int(os.getenv("PDF_REVALIDATE_SECONDS", "3600"))
+
+_URL_INDEX = "urls.json"
+_index_lock = threading.Lock()
+
+# "pdfplumber" keeps layout-aware text; "pdfminer" skips layout analysis and
+# is noticeably faster when only the raw words matter.
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", "pdfplumber")
+BACKENDS = ("pdfplumber", "pdfminer")
+
+# -----------------------------
+# Async download / extraction
+# -----------------------------
+# pdfplumber and the cache's file I/O are blocking, so the async entry points
+# run extraction on a small bounded pool, and the quick URL-index lookups on
+# the default thread pool, instead of on the event loop.
+EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="pdf")
+_extract_flights = SingleFlight("extract")
+
+# -----------------------------
+# Download limits
+# -----------------------------
+# Bodies are streamed and hashed chunk by chunk; anything past
+# PDF_SPOOL_BYTES goes to a temp file instead of staying in memory.
+PDF_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(50 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "1000"))
+PDF_SPOOL_BYTES = int(os.getenv("PDF_SPOOL_BYTES", str(8 * 1024 * 1024)))
+PDF_CONNECT_TIMEOUT = float(os.getenv("PDF_CONNECT_TIMEOUT", "5"))
+PDF_READ_TIMEOUT = float(os.getenv("PDF_READ_TIMEOUT", "30"))
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _timeout():
+    import httpx
+
+    return httpx.Timeout(PDF_READ_TIMEOUT, connect=PDF_CONNECT_TIMEOUT)
+
+# -----------------------------
+# Parallel whole-document extraction
+# -----------------------------
+# Documents with at least PDF_PARALLEL_MIN_PAGES pages are split into page
+# ranges and extracted on a process pool when the whole text is needed.
+PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: forking a process that already runs threads is unsafe
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _process_pool
+
+
+def _cache_path(name):
+    return os.path.join(PDF_CACHE_DIR, name)
+
+
+def _entry_path(sha256, backend="pdfplumber"):
+    if backend == "pdfplumber":
+        return _cache_path(f"{sha256}.json")
+    return _cache_path(f"{sha256}.{backend}.json")
+
+
+def _load_url_index():
+    try:
+        with open(_cache_path(_URL_INDEX), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_url_index(index):
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    tmp = _cache_path(f"{_URL_INDEX}.{threading.get_ident()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, _cache_path(_URL_INDEX))
+
+
+def get_cache_entry(sha256, backend="pdfplumber"):
+    """
+    Returns {"pages": [...], "complete": bool} for a content hash, or None.
+    Entries written by a budgeted extraction hold only the leading pages.
+    Reading an entry bumps its mtime, which is what LRU eviction orders by.
+    """
+    path = _entry_path(sha256, backend)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entry = {"pages": data["pages"], "complete": data.get("complete", True)}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return entry
+
+
+def _url_record(value):
+    # {"sha256", "checked", "etag"?, "last_modified"?}; older indexes held the hash only
+    if isinstance(value, str):
+        return {"sha256": value, "checked": 0}
+    return value
+
+
+def content_hash_for_url(pdf_url):
+    """SHA-256 of the PDF last downloaded from pdf_url, or None if it never was."""
+    record = _load_url_index().get(pdf_url)
+    return _url_record(record)["sha256"] if record else None
+
+
+def _lookup_url(pdf_url, backend="pdfplumber"):
+    """(cache entry or None, URL index record or None) for pdf_url."""
+    record = _load_url_index().get(pdf_url)
+    if not record:
+        return None, None
+    record = _url_record(record)
+    return get_cache_entry(record["sha256"], backend), record
+
+
+def _needs_revalidation(record):
+    """True once a URL with validators has gone PDF_REVALIDATE_SECONDS unchecked."""
+    if not record or not (record.get("etag") or record.get("last_modified")):
+        return False
+    return time.time() - record.get("checked", 0) >= PDF_REVALIDATE_SECONDS
+
+
+def _mark_checked(pdf_url):
+    with _index_lock:
+        index = _load_url_index()
+        if pdf_url in index:
+            index[pdf_url] = dict(_url_record(index[pdf_url]), checked=time.time())
+            _save_url_index(index)
+
+
+def store_cache_entry(sha256, pages, complete=True, backend="pdfplumber", pdf_url=None, validators=None):
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+
+    path = _entry_path(sha256, backend)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "sha256": sha256,
+            "created": time.time(),
+            "complete": complete,
+            "pages": pages,
+        }, f)
+    os.replace(tmp, path)
+
+    if pdf_url:
+        with _index_lock:
+            index = _load_url_index()
+            index[pdf_url] = {"sha256": sha256, "checked": time.time(), **(validators or {})}
+            _save_url_index(index)
+
+    evict_cache()
+
+
+def evict_cache():
+    """
+    Drops least-recently-used entries until the cache is within
+    PDF_CACHE_MAX_BYTES and PDF_CACHE_MAX_ENTRIES.
+    """
+    try:
+        names = [n for n in os.listdir(PDF_CACHE_DIR)
+                 if n.endswith(".json") and n != _URL_INDEX]
+    except OSError:
+        return
+
+    entries = []
+    for name in names:
+        try:
+            st = os.stat(_cache_path(name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    evicted = False
+
+    while entries and (total > PDF_CACHE_MAX_BYTES or len(entries) > PDF_CACHE_MAX_ENTRIES):
+        _, size, name = entries.pop(0)
+        try:
+            os.remove(_cache_path(name))
+        except OSError:
+            pass
+        total -= size
+        evicted = True
+
+    if evicted:
+        remaining = {name.split(".", 1)[0] for _, _, name in entries}
+        with _index_lock:
+            index = _load_url_index()
+            index = {url: record for url, record in index.items()
+                     if _url_record(record)["sha256"] in remaining}
+            _save_url_index(index)
+
+
+# -----------------------------
+# Extraction
+# -----------------------------
+def iter_pdf_pages(pdf_file, backend="pdfplumber", start=0, stop=None):
+    """
+    Yields the text of each page in [start, stop), one page at a time.
+    Pages are only parsed when the caller asks for them, so stopping early
+    skips the rest of the document.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown PDF text backend: {backend}")
+
+    if backend == "pdfminer":
+        yield from _iter_pdfminer_pages(pdf_file, start, stop)
+        return
+
+    # imported on first use: pdfplumber (and pdfminer) slow down server start
+    import pdfplumber
+
+    with pdfplumber.open(pdf_file) as pdf:
+        for page in pdf.pages[start:stop]:
+            yield page.extract_text() or ""
+
+
+def _iter_pdfminer_pages(pdf_file, start=0, stop=None):
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.converter import TextConverter
+
+    close = False
+    if isinstance(pdf_file, (str, os.PathLike)):
+        pdf_file = open(pdf_file, "rb")
+        close = True
+
+    try:
+        resources = PDFResourceManager(caching=True)
+        for i, page in enumerate(PDFPage.get_pages(pdf_file)):
+            if stop is not None and i >= stop:
+                break
+            if i < start:
+                continue
+            out = io.StringIO()
+            # laparams=None skips layout analysis entirely
+            device = TextConverter(resources, out, laparams=None)
+            PDFPageInterpreter(resources, device).process_page(page)
+            device.close()
+            yield out.getvalue()
+    finally:
+        if close:
+            pdf_file.close()
+
+
+def take_pages(pages, max_chars=None, pages_so_far=None):
+    """
+    Pulls pages from an iterator until the joined text reaches max_chars.
+    Returns (pages, complete) where complete means the iterator ran out.
+    """
+    taken = list(pages_so_far or [])
+    total = sum(len(p) + 1 for p in taken if p)
+
+    if max_chars is not None and total >= max_chars:
+        return taken, False
+
+    for page_text in pages:
+        taken.append(page_text)
+        if page_text:
+            total += len(page_text) + 1
+        if max_chars is not None and total >= max_chars:
+            if hasattr(pages, "close"):
+                pages.close()
+            return taken, False
 
-def extract_text_from_pdf_url(pdf_url):
-    response = requests.get(pdf_url)
-    response.raise_for_status()
+    return taken, True
 
-    pdf_bytes = io.BytesIO(response.content)
 
-    text = ""
-    with pdfplumber.open(pdf_bytes) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
+def extract_pages(pdf_file, max_chars=None, backend="pdfplumber"):
+    pages, _ = take_pages(iter_pdf_pages(pdf_file, backend), max_chars)
+    return pages
 
+
+def join_pages(pages, max_chars=None):
+    text = "".join(page_text + "\n" for page_text in pages if page_text)
+    if max_chars is not None:
+        text = text[:max_chars]
     return text
+
+
+# Numbered or all-caps heading lines are preferred places to split a long page
+_HEADING = re.compile(r"^\s*(\d+(\.\d+)*\.?\s+\S|[A-Z][A-Z0-9 ,:&-]{3,}$)")
+
+
+def _split_sections(page_text, max_chars):
+    """Splits an oversized page at blank lines or headings, then hard-wraps."""
+    sections, current = [], []
+    for line in page_text.split("\n"):
+        if current and (not line.strip() or _HEADING.match(line)):
+            sections.append("\n".join(current))
+            current = []
+        if line.strip():
+            current.append(line)
+    if current:
+        sections.append("\n".join(current))
+
+    pieces = []
+    for section in sections:
+        while len(section) > max_chars:
+            pieces.append(section[:max_chars])
+            section = section[max_chars:]
+        pieces.append(section)
+    return pieces
+
+
+def chunk_pages(pages, max_chars):
+    """
+    Groups consecutive pages into chunks of at most max_chars, never cutting
+    a page in half unless the page alone is over the limit.
+    """
+    chunks, current, size = [], [], 0
+
+    for page_text in pages:
+        if not page_text or not page_text.strip():
+            continue
+        parts = [page_text] if len(page_text) <= max_chars else _split_sections(page_text, max_chars)
+        for part in parts:
+            if current and size + len(part) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(part)
+            size += len(part) + 1
+
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def count_pages(pdf_file):
+    import pdfplumber
+
+    with pdfplumber.open(pdf_file) as pdf:
+        return len(pdf.pages)
+
+
+def _extract_page_range(file_path, start, stop, backend):
+    """
+    Process-pool worker. Each worker maps the shared temp file instead of
+    receiving the PDF bytes, so nothing but the path crosses the process
+    boundary on the way in.
+    """
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return list(iter_pdf_pages(mapped, backend, start, stop))
+
+
+def extract_pages_parallel(file_path, backend="pdfplumber", workers=None, n_pages=None):
+    """
+    Extracts every page of a PDF on disk by splitting it into page ranges
+    across the process pool, then reassembles them in page order.
+    """
+    if n_pages is None:
+        n_pages = count_pages(file_path)
+    if n_pages == 0:
+        return []
+
+    workers = workers or PARALLEL_WORKERS
+    # A few ranges per worker keeps the pool busy when pages vary in cost
+    range_size = max(1, math.ceil(n_pages / (workers * 4)))
+    ranges = [(start, min(start + range_size, n_pages))
+              for start in range(0, n_pages, range_size)]
+
+    pool = _get_process_pool()
+    futures = [pool.submit(_extract_page_range, file_path, start, stop, backend)
+               for start, stop in ranges]
+
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+def extract_text_from_pdf(file_path, parallel=None, backend="pdfplumber"):
+    """
+    parallel=None picks the process pool automatically for documents of at
+    least PARALLEL_MIN_PAGES pages.
+    """
+    n_pages = count_pages(file_path)
+    if parallel is None:
+        parallel = PARALLEL_WORKERS > 1 and n_pages >= PARALLEL_MIN_PAGES
+
+    if parallel:
+        pages = extract_pages_parallel(file_path, backend, n_pages=n_pages)
+    else:
+        pages = extract_pages(file_path, backend=backend)
+    return join_pages(pages)
+
+
+def _extract_all_pages(pdf, backend="pdfplumber"):
+    n_pages = min(count_pages(pdf.source()), PDF_MAX_PAGES)
+    if PARALLEL_WORKERS <= 1 or n_pages < PARALLEL_MIN_PAGES:
+        return list(iter_pdf_pages(pdf.source(), backend, stop=PDF_MAX_PAGES))
+
+    print(f"[PDF] Extracting {n_pages} pages on {PARALLEL_WORKERS} processes")
+    return extract_pages_parallel(pdf.spill(), backend, n_pages=n_pages)
+
+
+# -----------------------------
+# Streaming download
+# -----------------------------
+class PDFTooLargeError(ValueError):
+    """Raised when a download is larger than PDF_MAX_BYTES."""
+
+
+class PDFNoTextError(ValueError):
+    """Raised when a PDF has no extractable text (e.g. a scan)."""
+
+
+class DownloadedPDF:
+    """
+    A downloaded PDF that lives in memory up to PDF_SPOOL_BYTES and in a
+    temp file past that. The SHA-256 is computed while the bytes arrive.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.validators = {}  # ETag / Last-Modified, see http_client.validators
+        self.path = None
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._digest = hashlib.sha256()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > PDF_MAX_BYTES:
+            raise PDFTooLargeError(f"PDF is larger than {PDF_MAX_BYTES} bytes")
+
+        self._digest.update(chunk)
+        if self._file is None and self.size > PDF_SPOOL_BYTES:
+            self.spill()
+        (self._file or self._buffer).write(chunk)
+
+    def spill(self):
+        """Moves the bytes to a temp file (if they aren't already) and returns its path."""
+        if self._file is None:
+            fd, self.path = tempfile.mkstemp(suffix=".pdf")
+            self._file = os.fdopen(fd, "w+b")
+            self._file.write(self._buffer.getvalue())
+            self._buffer = None
+        self._file.flush()
+        return self.path
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def source(self):
+        """Something pdfplumber can open: the temp file path or a fresh in-memory stream."""
+        if self._file is not None:
+            return self.spill()
+        return io.BytesIO(self._buffer.getvalue())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.path)
+            self._file = None
+        self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _check_content_length(headers):
+    declared = headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > PDF_MAX_BYTES:
+        raise PDFTooLargeError(f"PDF is larger than {PDF_MAX_BYTES} bytes")
+
+
+async def download_pdf_async(pdf_url, validators=None):
+    """
+    Streams pdf_url into a DownloadedPDF over the shared pooled client.
+    With the validators of an earlier download, the request is conditional
+    and None is returned if the server answers 304 Not Modified.
+    """
+    pdf = DownloadedPDF()
+    try:
+        with metrics.stage("download"):
+            async with http_client.async_client().stream(
+                "GET", pdf_url, headers=http_client.conditional_headers(validators or {}), timeout=_timeout()
+            ) as response:
+                if validators and response.status_code == 304:
+                    pdf.close()
+                    return None
+                response.raise_for_status()
+                _check_content_length(response.headers)
+                pdf.validators = http_client.validators(response.headers)
+                async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+                    pdf.write(chunk)
+    except Exception:
+        pdf.close()
+        raise
+    return pdf
+
+
+def _covers(entry, max_chars):
+    if entry is None:
+        return False
+    if entry["complete"]:
+        return True
+    return max_chars is not None and len(join_pages(entry["pages"])) >= max_chars
+
+
+def _not_modified(pdf_url):
+    print(f"[PDF CACHE] Not modified (304): {pdf_url}")
+    metrics.CACHE_LOOKUPS.labels("pdf_url", "not_modified").inc()
+    _mark_checked(pdf_url)
+
+
+def _pages_for_download(pdf, pdf_url, max_chars=None, backend="pdfplumber"):
+    sha256 = pdf.sha256
+    entry = get_cache_entry(sha256, backend)
+    metrics.cache_lookup("pdf_content", _covers(entry, max_chars))
+    if _covers(entry, max_chars):
+        print(f"[PDF CACHE] Content hit: {sha256[:12]}")
+        pages, complete = entry["pages"], entry["complete"]
+    elif max_chars is None and entry is None:
+        with metrics.stage("extract"):
+            pages, complete = _extract_all_pages(pdf, backend), True
+    else:
+        # Resume after whatever a smaller budget already extracted
+        done = entry["pages"] if entry else []
+        with metrics.stage("extract"):
+            pages, complete = take_pages(
+                iter_pdf_pages(pdf.source(), backend, start=len(done), stop=PDF_MAX_PAGES),
+                max_chars,
+                pages_so_far=done,
+            )
+
+    store_cache_entry(sha256, pages, complete, backend, pdf_url=pdf_url, validators=pdf.validators)
+    return pages
+
+
+async def extract_pages_from_pdf_url_async(pdf_url, max_chars=None, backend=PDF_TEXT_BACKEND):
+    # A burst of requests for the same file shares one download + extraction
+    return await _extract_flights.do(
+        (pdf_url, max_chars, backend),
+        lambda: _extract_pages_from_pdf_url_async(pdf_url, max_chars, backend),
+    )
+
+
+async def _extract_pages_from_pdf_url_async(pdf_url, max_chars, backend):
+    loop = asyncio.get_running_loop()
+
+    # Cache lookups stay off the extraction pool: a hit must never queue
+    # behind long pdfplumber runs
+    entry, record = await asyncio.to_thread(_lookup_url, pdf_url, backend)
+    covered = _covers(entry, max_chars)
+    metrics.cache_lookup("pdf_url", covered)
+    revalidate = covered and _needs_revalidation(record)
+    if covered and not revalidate:
+        print(f"[PDF CACHE] URL hit: {pdf_url}")
+        return entry["pages"]
+
+    pdf = await download_pdf_async(pdf_url, validators=record if revalidate else None)
+    if pdf is None:
+        await asyncio.to_thread(_not_modified, pdf_url)
+        return entry["pages"]
+    with pdf:
+        return await loop.run_in_executor(
+            _executor, _pages_for_download, pdf, pdf_url, max_chars, backend
+        )
@@ -0,0 +1,95 @@
+import os
+import time
+import asyncio
+from urllib.parse import urlparse
+
+import llm
+from pdf_utils import extract_pages_from_pdf_url_async, join_pages
+from gemini import summarize_pdf_url
+
+# -----------------------------
+# Background ingestion of Classroom materials
+# -----------------------------
+# After a course listing, PDF link attachments of every course are downloaded
+# and extracted into the PDF page cache (and optionally summarized into the
+# LLM cache) so that opening them later is a cache hit. At most
+# PREFETCH_CONCURRENCY files are processed at once.
+# Summaries run at bulk priority: chat, streamed summaries and single quiz /
+# flashcard requests go first, while batched decks and quizzes, paging and
+# jobs share the bulk queue with them.
+# Drive attachments are skipped: they need the user's credentials, and no
+# endpoint downloads with credentials, so their cache could never be hit.
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "3"))
+PREFETCH_MAX_FILES = int(os.getenv("PREFETCH_MAX_FILES", "50"))
+
+# Progress of the latest run per user
+_runs = {}
+
+
+def _is_pdf_name(name):
+    return bool(name) and name.lower().endswith(".pdf")
+
+
+def pdf_attachments(materials):
+    """
+    PDF link attachments found in a course's courseWork, courseWorkMaterials
+    and announcements, as (url, title) with duplicates removed.
+    """
+    found, seen = [], set()
+    for key in ("courseWork", "courseWorkMaterials", "announcements"):
+        for item in materials.get(key) or []:
+            for material in item.get("materials") or []:
+                url = (material.get("link") or {}).get("url", "")
+                if not _is_pdf_name(urlparse(url).path) or url in seen:
+                    continue
+                seen.add(url)
+                found.append((url, material["link"].get("title") or url))
+    return found
+
+
+def status(user):
+    return _runs.get(user)
+
+
+def start_run(user):
+    """Registers a new run for user; None if one is still in progress."""
+    run = _runs.get(user)
+    if run is not None and run["finished"] is None:
+        return None
+    run = {"started": time.time(), "finished": None, "total": None, "done": 0, "failed": []}
+    _runs[user] = run
+    return run
+
+
+def finish_run(run):
+    if run["finished"] is None:
+        run["finished"] = time.time()
+
+
+async def prefetch_pdfs(run, attachments, summarize=False):
+    """
+    Extracts (and optionally summarizes) every attachment, at most
+    PREFETCH_CONCURRENCY at a time. The summary is the one a default
+    /summarize (empty prompt) returns, so that request is a cache hit.
+    Failures are recorded, never raised.
+    """
+    attachments = attachments[:PREFETCH_MAX_FILES]
+    run["total"] = len(attachments)
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+    async def ingest(url, title):
+        async with semaphore:
+            try:
+                pages = await extract_pages_from_pdf_url_async(url)
+                if summarize and join_pages(pages).strip():
+                    await summarize_pdf_url(url, "", priority=llm.PRIORITY_BULK)
+                run["done"] += 1
+            except Exception as e:
+                print(f"[PREFETCH] {title} failed: {e}")
+                run["failed"].append(title)
+
+    print(f"[PREFETCH] Ingesting {len(attachments)} PDFs")
+    await asyncio.gather(*(ingest(*attachment) for attachment in attachments))
+    finish_run(run)
+    print(f"[PREFETCH] Done: {run['done']}/{run['total']} in {run['finished'] - run['started']:.1f}s")
+    return run
@@ -1,51 +1,99 @@
 import os
-import json
-import warnings
-from dotenv import load_dotenv
 
-import google.generativeai as genai
-
-# -----------------------------
-# Silence noisy warnings
-# -----------------------------
-warnings.filterwarnings(
-    "ignore",
-    message="Field name .* shadows an attribute in parent .*"
-)
-
-# -----------------------------
-# Load environment variables
-# -----------------------------
-load_dotenv()
-
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    raise RuntimeError("❌ GEMINI_API_KEY not found in environment variables")
-
-# -----------------------------
-# Configure OLD Gemini SDK
-# -----------------------------
-genai.configure(api_key=API_KEY)
-
-model = genai.GenerativeModel(
-    model_name="gemini-flash-latest"
-)
+import llm
+import llm_cache
+import context
+import batching
+import structured
+
+# The Gemini client itself (and its rate limits) lives in llm.py
+MODEL_NAME = llm.MODEL_NAME
+
+# Tokens of source text sent to the model (see context.select_context)
+QUIZ_CONTEXT_TOKENS = int(os.getenv("QUIZ_CONTEXT_TOKENS", "3500"))
+# Characters of the document slice each batch of a large quiz draws from,
+# sized so a slice fits the per-call token budget
+QUIZ_MAX_CHARS = context.chars_for_tokens(QUIZ_CONTEXT_TOKENS)
+
+# Bump whenever the prompt changes so cached quizzes are regenerated
+PROMPT_VERSION = "quiz-v2"
+
+OPTION_KEYS = ["A", "B", "C", "D"]
+
+QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {
+            "type": "object",
+            "properties": {k: {"type": "string"} for k in OPTION_KEYS},
+            "required": OPTION_KEYS,
+        },
+        "answer": {"type": "string", "enum": OPTION_KEYS},
+    },
+    "required": ["question", "options", "answer"],
+}
 
 # -----------------------------
 # Quiz Generator
 # -----------------------------
-def generate_quiz(text: str, n_questions: int = 5):
-    print("\n--- QUIZ GENERATION START ---")
-
-    # 1. Input validation
-    if not text or len(text.strip()) < 50:
-        print("❌ ERROR: Text is empty or too short.")
-        return []
+async def generate_quiz(text: str, n_questions: int = 5, regenerate: bool = False,
+                        priority: int = llm.PRIORITY_NORMAL):
+    """`text` is used as given; callers size it to QUIZ_CONTEXT_TOKENS."""
+    key = llm_cache.cache_key(
+        MODEL_NAME, PROMPT_VERSION, text=text, n_questions=n_questions
+    )
+    return await llm_cache.cached(
+        key, lambda: _generate_quiz(text, n_questions, priority=priority), bypass=regenerate
+    )
+
+
+async def generate_quiz_batched(pages, n_questions: int, regenerate: bool = False):
+    """
+    Large quizzes: questions are spread over batches drawn from different
+    parts of the document, generated concurrently (at bulk priority) and
+    de-duplicated.
+    """
+    pages = context.strip_boilerplate(pages)
+    batches = batching.plan_batches(pages, n_questions, QUIZ_MAX_CHARS)
+    return await batching.generate_in_batches(
+        lambda text, n: generate_quiz(text, n, regenerate=regenerate, priority=llm.PRIORITY_BULK),
+        batches,
+        n_questions,
+        key=lambda q: f"{q['question']} {q['options'][q['answer']]}",
+    )
+
+
+async def generate_more_quiz(pages, n_questions: int, exclude=(), start: int = 0):
+    """
+    Paging (see artifacts.py): n_questions questions that differ from
+    `exclude`, drawn from the document slices `start` batches along.
+    Not cached here; the artifact store keeps the results.
+    """
+    pages = context.strip_boilerplate(pages)
+    batches = batching.plan_batches(pages, n_questions, QUIZ_MAX_CHARS, start=start)
+    return await batching.generate_in_batches(
+        lambda text, n: _generate_quiz(text, n, exclude, llm.PRIORITY_BULK),
+        batches,
+        n_questions,
+        key=lambda q: f"{q['question']} {q['options'][q['answer']]}",
+    )
+
+
+def question_key(item):
+    return item["question"]
+
+
+def build_quiz_prompt(text: str, n_questions: int, exclude=()):
+    avoid = ""
+    if exclude:
+        listed = "\n".join(f"- {question}" for question in exclude)
+        avoid = f"""
+DO NOT REPEAT OR REPHRASE THESE EXISTING QUESTIONS:
+{listed}
+"""
 
-    # -----------------------------
-    # SYSTEM + USER INSTRUCTIONS
-    # -----------------------------
-    prompt = f"""
+    return f"""
 SYSTEM INSTRUCTIONS (MANDATORY):
 You are an intelligent quiz-generation engine.
 
@@ -63,61 +111,45 @@ CORE BEHAVIOR RULES:
    - Return an empty JSON array [].
 
 OUTPUT FORMAT RULES (CRITICAL):
-- Output ONLY valid JSON
-- No markdown
-- No explanations
-- No comments
-- No trailing text
-- Strictly follow the schema below
-
-JSON SCHEMA:
-[
-  {{
-    "question": "string",
-    "options": {{
-      "A": "string",
-      "B": "string",
-      "C": "string",
-      "D": "string"
-    }},
-    "answer": "A" | "B" | "C" | "D"
-  }}
-]
-
+- Every question has options "A" to "D" and an "answer" naming the correct option
+{avoid}
 TEXT TO ANALYZE:
-{text[:15000]}
+{text}
 """
 
-    try:
-        print("📡 Sending request to Gemini (OLD SDK)...")
 
-        response = model.generate_content(
-            prompt,
-        )
+def _valid_question(item):
+    if not isinstance(item, dict) or not isinstance(item.get("question"), str):
+        return False
+    options = item.get("options")
+    if not isinstance(options, dict) or any(not isinstance(options.get(k), str) for k in OPTION_KEYS):
+        return False
+    return item.get("answer") in OPTION_KEYS and item["question"].strip() != ""
 
-        if not response or not response.text:
-            print("❌ ERROR: Empty response from Gemini.")
-            return []
 
-        # -----------------------------
-        # Parse & Validate JSON
-        # -----------------------------
-        parsed_data = json.loads(response.text)
+async def _generate_quiz(text: str, n_questions: int, exclude=(), priority=llm.PRIORITY_NORMAL):
+    print("\n--- QUIZ GENERATION START ---")
 
-        if not isinstance(parsed_data, list):
-            print("❌ ERROR: Output is not a JSON array.")
-            return []
+    # 1. Input validation
+    if not text or len(text.strip()) < 50:
+        print("❌ ERROR: Text is empty or too short.")
+        return []
 
-        print(f"✅ Generated {len(parsed_data)} questions.")
-        # print(parsed_data)
-        return parsed_data
+    try:
+        print("📡 Sending request to Gemini (JSON mode)...")
+
+        questions = await structured.generate_items(
+            lambda count, exclude: build_quiz_prompt(text, count, exclude),
+            QUESTION_SCHEMA,
+            n_questions,
+            validate=_valid_question,
+            key=question_key,
+            priority=priority,
+            exclude=exclude,
+        )
 
-    except json.JSONDecodeError:
-        print("❌ ERROR: Gemini returned invalid JSON.")
-        print("---- RAW OUTPUT ----")
-        print(response.text)
-        print("--------------------")
-        return []
+        print(f"✅ Generated {len(questions)} questions.")
+        return questions
 
     except Exception as e:
         print(f"❌ QUIZ ERROR: {e}")
@@ -0,0 +1,160 @@
+import os
+import re
+import json
+import math
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+
+import metrics
+from pdf_utils import extract_pages_from_pdf_url_async, join_pages, chunk_pages
+
+# -----------------------------
+# Local BM25 retrieval over course PDFs
+# -----------------------------
+# Each document is split into page-tagged passages and stored as an inverted
+# index on disk, keyed by a hash of its extracted text. Queries merge the
+# postings of every requested document and score them with Okapi BM25, so
+# only the top-k passages ever reach the chat prompt.
+INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", os.path.join("cache", "index"))
+PASSAGE_CHARS = int(os.getenv("RETRIEVAL_PASSAGE_CHARS", "1200"))
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the
+this to was were will with what which who how why when where does do can
+""".split())
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+_MAX_LOADED = 64
+
+
+def tokenize(text):
+    return [w for w in _WORD.findall(text.lower()) if len(w) > 1 and w not in _STOPWORDS]
+
+
+def document_id(pages):
+    return hashlib.sha256(join_pages(pages).encode("utf-8")).hexdigest()
+
+
+def _index_path(doc_id):
+    return os.path.join(INDEX_DIR, f"{doc_id}.json")
+
+
+def build_index(pages):
+    """
+    Returns {"passages": [{"page", "text"}], "lengths": [...],
+             "postings": {term: [[passage, tf], ...]}} for one document.
+    """
+    passages, lengths, postings = [], [], {}
+
+    for page_number, page_text in enumerate(pages, start=1):
+        for text in chunk_pages([page_text], PASSAGE_CHARS):
+            counts = Counter(tokenize(text))
+            if not counts:
+                continue
+            i = len(passages)
+            passages.append({"page": page_number, "text": text})
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([i, tf])
+
+    return {"passages": passages, "lengths": lengths, "postings": postings}
+
+
+def load_or_build_index(pages):
+    """Returns (doc_id, index), reading it from disk or building and saving it."""
+    doc_id = document_id(pages)
+
+    with _loaded_lock:
+        if doc_id in _loaded:
+            metrics.cache_lookup("retrieval_index", True)
+            return doc_id, _loaded[doc_id]
+
+    path = _index_path(doc_id)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        metrics.cache_lookup("retrieval_index", True)
+    except (OSError, ValueError):
+        metrics.cache_lookup("retrieval_index", False)
+        print(f"[RETRIEVAL] Building index for {doc_id[:12]}")
+        with metrics.stage("index"):
+            index = build_index(pages)
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, path)
+
+    with _loaded_lock:
+        if len(_loaded) >= _MAX_LOADED:
+            _loaded.pop(next(iter(_loaded)))
+        _loaded[doc_id] = index
+    return doc_id, index
+
+
+@metrics.stage("search")
+def search(indexes, query, k=TOP_K):
+    """
+    BM25 over the union of the given {doc_id: index} mapping. Corpus
+    statistics (N, df, average length) are pooled across documents so
+    scores are comparable between them.
+    Returns the top-k passages as dicts with doc_id, page, text and score.
+    """
+    terms = set(tokenize(query))
+    if not terms or not indexes:
+        return []
+
+    n_passages = sum(len(index["lengths"]) for index in indexes.values())
+    if n_passages == 0:
+        return []
+    avg_len = sum(sum(index["lengths"]) for index in indexes.values()) / n_passages
+
+    scores = {}
+    for term in terms:
+        df = sum(len(index["postings"].get(term, ())) for index in indexes.values())
+        if df == 0:
+            continue
+        idf = math.log(1 + (n_passages - df + 0.5) / (df + 0.5))
+
+        for doc_id, index in indexes.items():
+            lengths = index["lengths"]
+            for passage, tf in index["postings"].get(term, ()):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[passage] / avg_len)
+                key = (doc_id, passage)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+    top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    results = []
+    for (doc_id, passage), score in top:
+        hit = indexes[doc_id]["passages"][passage]
+        results.append({"doc_id": doc_id, "page": hit["page"], "text": hit["text"], "score": score})
+    return results
+
+
+async def retrieve(pdf_urls, query, k=TOP_K):
+    """
+    Extracts (through the PDF cache) and indexes every URL, then returns the
+    top-k passages for the query across all of them.
+    """
+    if not pdf_urls:
+        return []
+
+    pages_per_url = await asyncio.gather(
+        *(extract_pages_from_pdf_url_async(url) for url in pdf_urls)
+    )
+    loaded = await asyncio.gather(
+        *(asyncio.to_thread(load_or_build_index, pages) for pages in pages_per_url)
+    )
+    indexes = dict(loaded)
+    return await asyncio.to_thread(search, indexes, query, k)
+
+
+def format_passages(passages):
+    return "\n\n".join(f"[p. {p['page']}] {p['text']}" for p in passages)
@@ -0,0 +1,115 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+
+from context import count_tokens
+
+# -----------------------------
+# Server-side chat sessions
+# -----------------------------
+# Each session keeps a compacted memory plus the per-turn summaries added
+# since the last compaction. The memory sent with a prompt never exceeds
+# SESSION_MEMORY_TOKENS; once the stored turns go past that budget they are
+# folded into the compacted memory by a background LLM call.
+# Sessions live in this process only and are dropped after
+# SESSION_IDLE_SECONDS without a turn. IDs are always generated here: an
+# unknown ID (expired, made up, or issued by another worker) is refused
+# rather than silently started empty, so run the chat endpoints on a single
+# worker or route each session back to the worker that issued it.
+SESSION_MEMORY_TOKENS = int(os.getenv("SESSION_MEMORY_TOKENS", "800"))
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", str(2 * 3600)))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.memory = ""
+        self.turns = []
+        self.last_used = time.monotonic()
+        self.compacting = None
+
+
+_sessions = OrderedDict()
+_background = set()
+
+
+def _evict_idle():
+    cutoff = time.monotonic() - SESSION_IDLE_SECONDS
+    while _sessions:
+        oldest = next(iter(_sessions.values()))
+        if oldest.last_used >= cutoff and len(_sessions) <= SESSION_MAX:
+            break
+        _sessions.popitem(last=False)
+
+
+def get_session(session_id=None):
+    """
+    Returns the session for session_id, or a new session with a fresh ID if
+    session_id is empty. Returns None for an unknown session_id.
+    """
+    _evict_idle()
+
+    if session_id:
+        session = _sessions.get(session_id)
+        if session is None:
+            return None
+    else:
+        session = Session(uuid.uuid4().hex)
+        _sessions[session.id] = session
+
+    session.last_used = time.monotonic()
+    _sessions.move_to_end(session.id)
+    return session
+
+
+def memory_for_prompt(session):
+    """
+    Compacted memory followed by the newest turn summaries that fit in
+    SESSION_MEMORY_TOKENS. Older turns are only left out while a compaction
+    is still catching up.
+    """
+    budget = SESSION_MEMORY_TOKENS - count_tokens(session.memory)
+    recent = []
+    for turn in reversed(session.turns):
+        cost = count_tokens(turn)
+        if cost > budget:
+            break
+        recent.append(turn)
+        budget -= cost
+
+    parts = ([session.memory] if session.memory else []) + list(reversed(recent))
+    return "\n".join(parts)
+
+
+def remember(session, summary, compact):
+    """
+    Records a turn summary. When the session is over budget, schedules
+    compact(text, max_tokens) in the background to fold it down.
+    """
+    if summary:
+        session.turns.append(summary)
+
+    total = count_tokens(session.memory) + sum(count_tokens(t) for t in session.turns)
+    if total > SESSION_MEMORY_TOKENS and session.compacting is None:
+        task = asyncio.create_task(_compact(session, compact))
+        session.compacting = task
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+
+async def _compact(session, compact):
+    folded = len(session.turns)
+    text = "\n".join(([session.memory] if session.memory else []) + session.turns[:folded])
+    try:
+        # Leave half the budget for the turns that follow
+        session.memory = await compact(text, SESSION_MEMORY_TOKENS // 2)
+        # Turns added while the compaction ran are kept as-is
+        session.turns = session.turns[folded:]
+        print(f"[SESSION {session.id[:8]}] Compacted {folded} turns")
+    except Exception as e:
+        print(f"[SESSION {session.id[:8]}] Compaction failed: {e}")
+    finally:
+        session.compacting = None
@@ -0,0 +1,35 @@
+import asyncio
+
+import metrics
+
+# -----------------------------
+# Request coalescing
+# -----------------------------
+# Concurrent callers asking for the same key share one in-flight task: the
+# first caller starts the work, everyone else awaits its result (or its
+# exception). Once the task finishes the key is forgotten, so later calls
+# start fresh and rely on the caches for reuse.
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}
+        metrics.IN_FLIGHT_WORK.labels(name).set_function(self.in_flight)
+
+    async def do(self, key, fn):
+        """Runs fn() once per key at a time and returns its result to every waiter."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            metrics.COALESCED.labels(self.name).inc()
+            print(f"[SINGLEFLIGHT {self.name}] Joined in-flight work")
+
+        # shield: one waiter disconnecting must not cancel the shared work
+        return await asyncio.shield(task)
+
+    def in_flight(self):
+        return len(self._inflight)
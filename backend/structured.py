@@ -0,0 +1,219 @@
+import re
+import json
+
+import llm
+import metrics
+
+# -----------------------------
+# Structured (JSON) generation shared by quiz, flashcards and mention
+# -----------------------------
+# Every call uses Gemini's JSON mode with a response schema. Output is then
+# parsed leniently: array elements are decoded one at a time so a truncated
+# response keeps every complete item, and truncated objects are closed off
+# instead of being thrown away. Only missing items are ever asked for again.
+
+_FENCE_START = re.compile(r"^```(?:json)?\s*")
+_FENCE_END = re.compile(r"\s*```$")
+# Valid JSON escapes are matched as pairs so that only stray backslashes
+# (e.g. LaTeX \pi or \cos) get doubled
+_ESCAPE = re.compile(r'\\(["\\/bfnrt]|u[0-9a-fA-F]{4})?')
+
+
+def clean_json_text(raw):
+    text = (raw or "").strip()
+    text = _FENCE_START.sub("", text)
+    text = _FENCE_END.sub("", text)
+    return _ESCAPE.sub(lambda m: m.group(0) if m.group(1) else "\\\\", text)
+
+
+def parse_json_array(raw):
+    """
+    Decodes a JSON array element by element.
+    Returns (items, complete); complete is False when the array was cut off,
+    in which case items holds every element that was fully written.
+    """
+    text = clean_json_text(raw)
+    start = text.find("[")
+    if start == -1:
+        obj = parse_json_object(text)
+        return ([obj], True) if obj is not None else ([], False)
+
+    decoder = json.JSONDecoder()
+    items, pos = [], start + 1
+    while True:
+        while pos < len(text) and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(text):
+            return items, False
+        if text[pos] == "]":
+            return items, True
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return items, False
+        items.append(item)
+
+
+_SCALAR = re.compile(r"-?\d+(\.\d+)?([eE][-+]?\d+)?|true|false|null")
+# A string cut off inside a "\uXXXX" escape (after an odd run of backslashes)
+_PARTIAL_UNICODE = re.compile(r"(\\+)u[0-9a-fA-F]{0,3}$")
+
+
+def close_truncated_json(text):
+    """
+    Repairs a truncated JSON document: a cut-off string value is closed and
+    kept, anything else that was cut off (a key, a member missing its value,
+    a half-written number or literal) is trimmed back to the last complete
+    member, then the open brackets are closed.
+    """
+    # stack entries are [closer, expecting]; objects expect key, colon,
+    # value or end, arrays value or end
+    stack = []
+    good, good_closers = 0, ""
+
+    def closers():
+        return "".join(closer for closer, _ in reversed(stack))
+
+    def value_done(end):
+        nonlocal good, good_closers
+        if stack:
+            stack[-1][1] = "end"
+        good, good_closers = end, closers()
+
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        expecting = stack[-1][1] if stack else "value"
+        if ch in " \t\r\n":
+            i += 1
+        elif ch == '"':
+            j, escaped = i + 1, False
+            while j < len(text):
+                if escaped:
+                    escaped = False
+                elif text[j] == "\\":
+                    escaped = True
+                elif text[j] == '"':
+                    break
+                j += 1
+            if j >= len(text):
+                if expecting != "value":
+                    break  # cut off inside a key
+                return _drop_partial_escape(text, escaped) + '"' + closers()
+            i = j + 1
+            if expecting == "key":
+                stack[-1][1] = "colon"
+            else:
+                value_done(i)
+        elif ch in "[{":
+            stack.append(["]" if ch == "[" else "}", "value" if ch == "[" else "key"])
+            i += 1
+            good, good_closers = i, closers()
+        elif ch in "]}" and stack:
+            stack.pop()
+            value_done(i + 1)
+            i += 1
+        elif ch == ":" and expecting == "colon":
+            stack[-1][1] = "value"
+            i += 1
+        elif ch == "," and expecting == "end":
+            stack[-1][1] = "value" if stack[-1][0] == "]" else "key"
+            i += 1
+        else:
+            match = _SCALAR.match(text, i)
+            # a scalar running into the end of the text may be cut short
+            if expecting != "value" or not match or match.end() == len(text):
+                break
+            i = match.end()
+            value_done(i)
+
+    if not stack and good == i:
+        return text
+    return text[:good] + good_closers
+
+
+def _drop_partial_escape(text, escaped):
+    if escaped:
+        return text[:-1]
+    match = _PARTIAL_UNICODE.search(text)
+    if match and len(match.group(1)) % 2:
+        return text[:match.end(1) - 1]
+    return text
+
+
+def parse_json_object(raw):
+    """Decodes a JSON object, closing it off if it was truncated. Returns None on failure."""
+    text = clean_json_text(raw)
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = text[start:]
+
+    for candidate in (text, close_truncated_json(text)):
+        try:
+            obj, _ = json.JSONDecoder().raw_decode(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(obj, dict):
+            return obj
+    return None
+
+
+async def generate_json(prompt, schema, priority=llm.PRIORITY_NORMAL, **config):
+    """One JSON-mode generation call; returns the raw response text."""
+    response = await llm.generate(
+        prompt,
+        priority,
+        # a plain dict keeps the SDK's types out of this module's imports
+        generation_config=dict(
+            response_mime_type="application/json",
+            response_schema=schema,
+            **config,
+        ),
+    )
+    return response.text
+
+
+async def generate_items(build_prompt, item_schema, n, validate, key, top_up_rounds=1,
+                         priority=llm.PRIORITY_NORMAL, exclude=(), **config):
+    """
+    Generates n schema-constrained items.
+    build_prompt(count, exclude) must ask for `count` items that differ from
+    the `exclude` list of keys: the caller's `exclude` plus the items
+    accepted so far. Items failing validate() or repeating a key are
+    dropped; if the response was short or truncated, only the shortfall is
+    requested again (at most top_up_rounds times).
+    """
+    schema = {"type": "array", "items": item_schema}
+    exclude = list(exclude)
+    items, seen = [], set(exclude)
+
+    for round_number in range(1 + top_up_rounds):
+        missing = n - len(items)
+        if missing <= 0:
+            break
+
+        with metrics.stage("prompt"):
+            prompt = build_prompt(missing, exclude + [key(item) for item in items])
+        try:
+            raw = await generate_json(prompt, schema, priority, **config)
+        except Exception:
+            if round_number == 0:
+                raise
+            print("[STRUCTURED] Top-up call failed, keeping what we have")
+            break
+
+        with metrics.stage("parse"):
+            parsed, complete = parse_json_array(raw)
+        for item in parsed:
+            if not validate(item) or key(item) in seen:
+                continue
+            seen.add(key(item))
+            items.append(item)
+
+        if not complete:
+            print(f"[STRUCTURED] Output truncated, salvaged {len(parsed)} items")
+        if len(items) < n:
+            print(f"[STRUCTURED] {len(items)}/{n} valid items")
+
+    return items[:n]
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import db
+
+# -----------------------------
+# Shared OAuth token store
+# -----------------------------
+# Signed-in users' Google tokens live in a key-value store every server
+# process can reach, so any uvicorn worker or replica can serve any user
+# without sticky sessions. Backends implement three calls, the subset of
+# redis-py's API we need:
+#   get(key) -> str | None, set(key, value, ex=seconds),
+#   delete(key) -> number of live keys removed (atomically)
+# TOKEN_STORE picks one:
+#   "sqlite" (default)  a WAL database shared by every worker on the host
+#   "memory"            this process only (tests, single worker)
+#   "redis"             TOKEN_STORE_URL; needs `pip install redis`, works with
+#                       any server speaking the Redis protocol
+# or call set_backend() with any object providing those three methods.
+#
+# Entries expire TOKEN_TTL_SECONDS after they were last written; tokens are
+# rewritten on every refresh, so only idle sign-ins are evicted. Keys are
+# hashes of the OAuth state, and the app's client secret is never stored.
+TOKEN_STORE = os.getenv("TOKEN_STORE", "sqlite")
+TOKEN_STORE_PATH = os.getenv("TOKEN_STORE_PATH", os.path.join("cache", "tokens.sqlite3"))
+TOKEN_STORE_URL = os.getenv("TOKEN_STORE_URL", "redis://localhost:6379/0")
+TOKEN_TTL_SECONDS = int(os.getenv("TOKEN_TTL_SECONDS", str(30 * 24 * 3600)))
+# A /login state must come back through /callback within this long
+LOGIN_STATE_TTL_SECONDS = int(os.getenv("LOGIN_STATE_TTL_SECONDS", "600"))
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class MemoryStore:
+    """Process-local backend."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+            if len(self._data) % 100 == 0:
+                self._evict()
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            value, expires = self._data.pop(key, (None, None))
+            live = value is not None and (expires is None or expires > time.time())
+            return 1 if live else 0
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, (_, expires) in self._data.items() if expires is not None and expires <= now]:
+            del self._data[key]
+
+
+class SQLiteStore:
+    """File-backed backend, safe to share between processes on one host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = db.connect(self.path, """
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires REAL
+                );
+            """)
+            try:
+                os.chmod(self.path, 0o600)  # refresh tokens are credentials
+            except OSError:
+                pass
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ex=None):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, now + ex if ex else None),
+            )
+            self._writes += 1
+            if self._writes % 50 == 0:
+                conn.execute("DELETE FROM kv WHERE expires <= ?", (now,))
+            conn.commit()
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            conn = self._connect()
+            # an expired row counts as already gone, as in Redis
+            deleted = conn.execute(
+                "DELETE FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                (key, time.time()),
+            ).rowcount
+            conn.commit()
+        return deleted
+
+
+def _open(kind):
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "sqlite":
+        return SQLiteStore(TOKEN_STORE_PATH)
+    if kind == "redis":
+        import redis
+
+        return redis.Redis.from_url(TOKEN_STORE_URL, decode_responses=True)
+    raise ValueError(f"Unknown TOKEN_STORE {kind!r} (expected sqlite, memory or redis)")
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _open(TOKEN_STORE)
+    return _backend
+
+
+def set_backend(store):
+    """Plugs in any object with get/set(ex=)/delete, e.g. a Redis client."""
+    global _backend
+    _backend = store
+
+
+def _key(kind, state):
+    return f"{kind}:{hashlib.sha256(state.encode('utf-8')).hexdigest()}"
+
+
+# -----------------------------
+# Tokens and login states
+# -----------------------------
+def load(state):
+    """The stored token record for a signed-in user, or None."""
+    value = backend().get(_key("token", state))
+    return json.loads(value) if value else None
+
+
+def save(state, record):
+    """Stores a token record, restarting its TOKEN_TTL_SECONDS."""
+    backend().set(_key("token", state), json.dumps(record), ex=TOKEN_TTL_SECONDS)
+
+
+def delete(state):
+    backend().delete(_key("token", state))
+
+
+def start_login(state):
+    backend().set(_key("login", state), "1", ex=LOGIN_STATE_TTL_SECONDS)
+
+
+def finish_login(state):
+    """True (once) if `state` was issued by start_login and has not expired."""
+    # a single delete, so two workers can never both finish the same login
+    return backend().delete(_key("login", state)) > 0